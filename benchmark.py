@@ -0,0 +1,402 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from retriever import db, fetch, parsers
+from retriever.fetch import AsyncFetcher
+from retriever.movie_times_lib import _build_full_schedule
+from retriever.parsers import brattle, coolidge, fandango_json, markup, red_river
+from retriever.schedule import DaySchedule, Filter, FullSchedule, parse_clock_time
+from retriever.utils import JsonEncoder
+
+DEFAULT_TZNAME = "America/New_York"
+
+
+def _read_fixture(fixtures_dir, filename):
+    with open(os.path.join(fixtures_dir, filename)) as fixture_file:
+        return fixture_file.read()
+
+def _write_fixture(fixtures_dir, filename, text):
+    with open(os.path.join(fixtures_dir, filename), "w") as fixture_file:
+        fixture_file.write(text)
+
+
+async def _retrieve_coolidge_pages(date_range):
+    async with AsyncFetcher(coolidge.MAX_CONCURRENCY) as fetcher:
+        return await coolidge._retrieve_pages(fetcher, date_range)
+
+
+# Marks a fixtures directory whose pages were written by hand rather than
+# saved from the sites.
+SYNTHETIC_MARKER = "SYNTHETIC"
+
+
+def _save_parser_fixtures(fixtures_dir, day_count):
+    today = date.today()
+    pages = {
+        "brattle.html": brattle._retrieve_page(),
+        "red_river-sessions.html": red_river._retrieve_page(red_river.SHOWTIMES_URL),
+        "red_river-main.html": red_river._retrieve_page(red_river.MAIN_URL)
+    }
+    signature_programs_text, open_captions_text, showtimes_texts = asyncio.run(_retrieve_coolidge_pages((today, today + timedelta(days=day_count - 1))))
+    pages["coolidge-signature-programs.html"] = signature_programs_text
+    pages["coolidge-open-captions.html"] = open_captions_text
+    for showtimes_text, day in showtimes_texts:
+        pages[f"coolidge-showtimes-{day.isoformat()}.html"] = showtimes_text
+
+    # Only once every page is in hand, so a failed fetch leaves the old set
+    # whole.
+    os.makedirs(fixtures_dir, exist_ok=True)
+    for filename in os.listdir(fixtures_dir):
+        if filename == SYNTHETIC_MARKER or filename.startswith("coolidge-showtimes-"):
+            os.remove(os.path.join(fixtures_dir, filename))
+    for filename, text in pages.items():
+        _write_fixture(fixtures_dir, filename, text)
+
+
+def _coolidge_case(fixtures_dir, tzname):
+    signature_programs_text = _read_fixture(fixtures_dir, "coolidge-signature-programs.html")
+    open_captions_text = _read_fixture(fixtures_dir, "coolidge-open-captions.html")
+    day_texts = {}
+    for filename in sorted(os.listdir(fixtures_dir)):
+        if filename.startswith("coolidge-showtimes-"):
+            day = date.fromisoformat(filename.removeprefix("coolidge-showtimes-").removesuffix(".html"))
+            day_texts[day] = _read_fixture(fixtures_dir, filename)
+
+    def parse():
+        signature_programs_dict = coolidge._load_signature_programs(signature_programs_text)
+        open_captions_dict = coolidge._load_open_captions_showtimes(open_captions_text)
+        return open_captions_dict, [coolidge._parse_film_cards(text, signature_programs_dict) for text in day_texts.values()]
+
+    return parse, [signature_programs_text, open_captions_text, *day_texts.values()]
+
+
+def _parser_cases(fixtures_dir, tzname):
+    brattle_text = _read_fixture(fixtures_dir, "brattle.html")
+    yield "brattle", lambda: brattle._parse_page(brattle_text, tzname), [brattle_text]
+
+    sessions_text = _read_fixture(fixtures_dir, "red_river-sessions.html")
+    main_text = _read_fixture(fixtures_dir, "red_river-main.html")
+    yield "red_river", lambda: red_river._parse_pages(sessions_text, main_text, tzname), [sessions_text, main_text]
+
+    yield "coolidge", *_coolidge_case(fixtures_dir, tzname)
+
+
+# Brattle and Red River return showing records. Coolidge returns its open
+# captions and each day's film cards.
+def _has_showtimes(output):
+    if isinstance(output, tuple):
+        _, day_film_cards = output
+        return any(card["showings"] for film_cards in day_film_cards for card in film_cards)
+    return bool(output)
+
+
+def _time_parse(parse, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse()
+    return (time.perf_counter() - start) / iterations
+
+
+# Compares each parser's output using the targeted parse against a full
+# html.parser parse of the same saved pages, then times both.
+#
+# The committed pages in fixtures/parsers are synthetic: hand-written to carry
+# the markup each parser reads, padded out with filler. Matching on them is
+# only a smoke test. The strainers can still drop something a real page has
+# that these don't, so check them against live pages (--save) before relying
+# on a change to them.
+def parsers_main(fixtures_dir, save, day_count, iterations, tzname):
+    if save:
+        _save_parser_fixtures(fixtures_dir, day_count)
+
+    print(f"Backend: {os.environ.get('MOVIE_VIEWER_HTML_BACKEND', markup.DEFAULT_BACKEND)}")
+    if os.path.exists(os.path.join(fixtures_dir, SYNTHETIC_MARKER)):
+        print("Pages: synthetic, so this is a smoke test only (use --save to check against live pages)")
+    print()
+    mismatches = 0
+    for name, parse, texts in _parser_cases(fixtures_dir, tzname):
+        with markup.baseline():
+            baseline_output = parse()
+            baseline_secs = _time_parse(parse, iterations)
+
+        output = parse()
+        secs = _time_parse(parse, iterations)
+
+        megabytes = sum(len(text.encode()) for text in texts) / 1_000_000
+        # Pages that no longer match what a parser expects parse to nothing
+        # either way, which would otherwise pass as identical.
+        if not _has_showtimes(baseline_output):
+            match_str = "EMPTY"
+        else:
+            match_str = "identical" if output == baseline_output else "MISMATCH"
+        mismatches += match_str != "identical"
+        print(f"{name}: {len(texts)} page(s), {megabytes:.2f} MB, output {match_str}")
+        print(f"  baseline: {baseline_secs * 1000:.1f} ms/parse ({megabytes / baseline_secs:.2f} MB/s)")
+        print(f"  targeted: {secs * 1000:.1f} ms/parse ({megabytes / secs:.2f} MB/s), {baseline_secs / secs:.1f}x")
+
+    if mismatches:
+        sys.exit(f"{mismatches} parser(s) didn't match the baseline parse.")
+
+
+# How Showing._parse_showtime read showtimes before parse_clock_time.
+def _legacy_parse_clock_time(raw_showtime):
+    raw_showtime = raw_showtime.replace('p', 'pm').replace('a', 'am').replace('mm', 'm')
+    raw_showtime = raw_showtime.replace(" ", "")
+    try:
+        return datetime.strptime(raw_showtime, "%I:%M%p").time()
+    except Exception:
+        return datetime.strptime(raw_showtime, "%I%p").time()
+
+
+def _showtime_strs():
+    styles = ["{hr}:{min:02}{m}", "{hr}:{min:02} {M}", "{hr}:{min:02}{m}m", "{hr}{m}m"]
+    for hr in range(1, 13):
+        for min in range(0, 60, 5):
+            for m in ("a", "p"):
+                for style in styles:
+                    if style == "{hr}{m}m" and min:
+                        continue
+                    yield style.format(hr=hr, min=min, m=m, M=f"{m.upper()}M")
+
+
+def _time_showtime_parse(parse, raw_showtimes, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for raw_showtime in raw_showtimes:
+            parse(raw_showtime)
+    return (time.perf_counter() - start) / (iterations * len(raw_showtimes))
+
+
+# A scan parses each distinct showtime string many times over, which is what
+# the repeats here stand in for.
+def showtimes_main(repeats, iterations):
+    distinct = list(_showtime_strs())
+    raw_showtimes = distinct * repeats
+
+    mismatches = [raw_showtime for raw_showtime in distinct if parse_clock_time(raw_showtime) != _legacy_parse_clock_time(raw_showtime)]
+    print(f"{len(distinct)} distinct showtime(s), each parsed {repeats} time(s) per iteration, {len(mismatches)} mismatch(es)")
+    for raw_showtime in mismatches[:10]:
+        print(f"  {raw_showtime!r}: {parse_clock_time(raw_showtime)} != {_legacy_parse_clock_time(raw_showtime)}")
+
+    legacy_secs = _time_showtime_parse(_legacy_parse_clock_time, raw_showtimes, iterations)
+    parse_clock_time.cache_clear()
+    secs = _time_showtime_parse(parse_clock_time, raw_showtimes, iterations)
+    parse_clock_time.cache_clear()
+    uncached_secs = _time_showtime_parse(parse_clock_time.__wrapped__, raw_showtimes, iterations)
+
+    print(f"  strptime: {legacy_secs * 1_000_000:.2f} us/showtime")
+    print(f"  regex:    {uncached_secs * 1_000_000:.2f} us/showtime, {legacy_secs / uncached_secs:.1f}x")
+    print(f"  cached:   {secs * 1_000_000:.2f} us/showtime, {legacy_secs / secs:.1f}x")
+
+
+def _seat_map_showtimes(schedule):
+    showtimes = []
+    for movie in schedule.movies:
+        for showing in movie.showings:
+            showtimes.append({"title": movie.name, "start_time": showing.start, "screen": showing.screen, "extra_properties": showing.extra_properties})
+    return [showtime for showtime in showtimes if fandango_json.needs_screen_lookup(showtime)]
+
+
+def _scan_theater(theater_info, date_range, seat_maps):
+    schedule = _build_full_schedule(parsers.load_schedules_by_day(theater_info, date_range, True), date_range, Filter.empty())
+    if schedule and seat_maps and theater_info["parser"] == "fandango_json":
+        fandango_json.gather_seat_info(_seat_map_showtimes(schedule))
+    return schedule
+
+
+def _record_scan(archive_path, theaters, day_count, seat_maps):
+    today = date.today()
+    date_range = (today, today + timedelta(days=day_count - 1))
+    theater_infos = [db.get_theater(theater) for theater in theaters]
+
+    with parsers.scan_run():
+        for theater_info in theater_infos:
+            print(f"Recording {theater_info['name']}...")
+            _scan_theater(theater_info, date_range, seat_maps)
+
+    manifest = {"date_range": date_range, "theaters": theater_infos, "seat_maps": seat_maps}
+    with open(os.path.join(archive_path, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, cls=JsonEncoder, indent=2)
+
+
+# Runs a recorded scan theater by theater, with every response read back from
+# the archive, so the numbers only reflect parsing and storing.
+def _replay_scan(archive_path, store, memory):
+    with open(os.path.join(archive_path, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    date_range = tuple(date.fromisoformat(d) for d in manifest["date_range"])
+    archive = fetch.get_archive()
+
+    if memory:
+        tracemalloc.start()
+
+    # Every schedule is kept until the end, as a full scan would, so the peak
+    # covers everything it holds at once.
+    schedules = []
+    secs_by_parser = defaultdict(float)
+    print(f"Replaying {len(manifest['theaters'])} theater(s) from {date_range[0]} to {date_range[1]}\n")
+    with parsers.scan_run():
+        for theater_info in manifest["theaters"]:
+            hits = archive.hits
+            start = time.perf_counter()
+            schedule = _scan_theater(theater_info, date_range, manifest["seat_maps"])
+            collect_secs = time.perf_counter() - start
+
+            store_secs = 0
+            if store and schedule:
+                start = time.perf_counter()
+                db.store_showtimes(schedule)
+                store_secs = time.perf_counter() - start
+
+            schedules.append(schedule)
+            showtime_count = len(schedule) if schedule else 0
+            secs_by_parser[theater_info["parser"]] += collect_secs + store_secs
+            store_str = f", store {store_secs * 1000:.0f} ms" if store else ""
+            memory_str = f", {tracemalloc.get_traced_memory()[0] / 1_000_000:.1f} MB held" if memory else ""
+            print(f"{theater_info['name']} ({theater_info['parser']}): {archive.hits - hits} response(s), {showtime_count} showtime(s), collect {collect_secs * 1000:.0f} ms{store_str}{memory_str}")
+
+    print()
+    for parser, secs in sorted(secs_by_parser.items()):
+        print(f"{parser}: {secs * 1000:.0f} ms")
+
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"\nPeak memory: {peak / 1_000_000:.1f} MB")
+
+
+def scan_main(archive_path, record, theaters, day_count, seat_maps, store, memory):
+    os.environ["MOVIE_VIEWER_HTTP_ARCHIVE"] = archive_path
+    os.environ["MOVIE_VIEWER_HTTP_MODE"] = "record" if record else "replay"
+    if record:
+        theaters = theaters or os.environ.get("MOVIE_VIEWER_THEATERS", "").split(",")
+        _record_scan(archive_path, theaters, day_count, seat_maps)
+    else:
+        _replay_scan(archive_path, store, memory)
+
+
+STORE_THEATER = "Store Check Theater"
+STORE_DAYS = 7
+# Each case is the showtimes stored before a scan, then those the scan finds,
+# as (ID, day within the scanned range, time). Every case also has an
+# unchanged showtime on the first day, so that no scan comes back empty.
+STORE_CASES = {
+    "moved earlier": ([("X", 4, "7:00 PM")], [("X", 2, "7:00 PM")]),
+    "moved later": ([("X", 2, "7:00 PM")], [("X", 4, "7:00 PM")]),
+    "moved in from outside the range": ([("X", STORE_DAYS + 2, "7:00 PM")], [("X", 3, "7:00 PM")]),
+    "retimed": ([("X", 3, "7:00 PM")], [("X", 3, "9:30 PM")]),
+    "removed": ([("X", 3, "7:00 PM"), ("Y", 5, "7:00 PM")], [("Y", 5, "7:00 PM")]),
+    "added": ([], [("X", 3, "7:00 PM")]),
+    "swapped days": ([("X", 2, "7:00 PM"), ("Y", 5, "7:00 PM")], [("X", 5, "7:00 PM"), ("Y", 2, "7:00 PM")]),
+}
+
+
+def _store_case_schedules(first_day, showtimes, day_count):
+    schedules = [DaySchedule(STORE_THEATER, first_day + timedelta(days=offset)) for offset in range(day_count)]
+    for id_, offset, raw_time in [("ANCHOR", 0, "1:00 PM"), *showtimes]:
+        schedule = schedules[offset]
+        schedule.get_or_add_raw_movie(f"Movie {id_}", "90").add_raw_showing(id_, raw_time, schedule.day, DEFAULT_TZNAME, "Standard")
+    return schedules
+
+
+def _stored_state():
+    showtimes = {(s["id"], s["start_time"].isoformat()) for s in db.load_showtimes(None, None, STORE_THEATER)}
+    deleted_showtimes = sorted((s["id"], s["start_time"].isoformat()) for s in db.load_deleted_showtimes_by_delete_time(None))
+    return showtimes, deleted_showtimes
+
+
+# Runs one case against a fresh database, returning what's stored afterwards.
+def _run_store_case(first_day, stored, scanned, store):
+    with tempfile.TemporaryDirectory() as db_dir:
+        cwd = os.getcwd()
+        os.chdir(db_dir)
+        try:
+            db._init_db()
+            stored_day_count = max([STORE_DAYS] + [offset + 1 for _, offset, _ in stored])
+            db.store_showtimes(FullSchedule.create(_store_case_schedules(first_day, stored, stored_day_count)))
+            store(_store_case_schedules(first_day, scanned, STORE_DAYS))
+            return _stored_state()
+        finally:
+            os.chdir(cwd)
+
+
+# Checks that storing a scan day by day leaves the database just as storing
+# it merged into one schedule does, for showtimes that change between scans.
+def store_main():
+    if os.environ.get("DATABASE_URL"):
+        sys.exit("The store check builds scratch sqlite databases; unset DATABASE_URL to run it.")
+
+    first_day = date.today()
+    mismatches = 0
+    for name, (stored, scanned) in STORE_CASES.items():
+        merged_state = _run_store_case(first_day, stored, scanned, lambda schedules: db.store_showtimes(FullSchedule.create(schedules)))
+        by_day_state = _run_store_case(first_day, stored, scanned, db.store_showtimes_by_day)
+
+        # Whichever way they're stored, the showtimes must end up on the days the scan found them.
+        expected_days = {(id_, (first_day + timedelta(days=offset)).isoformat()) for id_, offset, _ in [("ANCHOR", 0, None), *scanned]}
+        stored_days = {(id_, start_time[:10]) for id_, start_time in by_day_state[0]}
+        ok = merged_state == by_day_state and stored_days == expected_days
+        mismatches += not ok
+        print(f"{name}: {'ok' if ok else 'MISMATCH'}")
+        if not ok:
+            print(f"  merged: {merged_state}")
+            print(f"  by day: {by_day_state}")
+
+    if mismatches:
+        sys.exit(f"{mismatches} case(s) stored incorrectly.")
+
+
+def main(args):
+    if args.benchmark == "parsers":
+        parsers_main(args.fixtures, args.save, args.days, args.iterations, args.tzname)
+    elif args.benchmark == "showtimes":
+        showtimes_main(args.repeats, args.iterations)
+    elif args.benchmark == "scan":
+        scan_main(args.archive, args.record, args.theaters, args.days, args.seat_maps, args.store, args.memory)
+    elif args.benchmark == "store":
+        store_main()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    subparsers = parser.add_subparsers(title="benchmarks", required=True)
+
+    parsers_parser = subparsers.add_parser("parsers", help="Smoke-test and time the HTML parsers against saved pages.")
+    parsers_parser.set_defaults(benchmark="parsers")
+    parsers_parser.add_argument("--fixtures", default="fixtures/parsers")
+    parsers_parser.add_argument("--save", action="store_true", help="Save fresh copies of the pages first.")
+    parsers_parser.add_argument("--days", type=int, default=7, help="How many Coolidge day pages to save.")
+    parsers_parser.add_argument("--iterations", type=int, default=5)
+    parsers_parser.add_argument("--tzname", default=DEFAULT_TZNAME)
+
+    showtimes_parser = subparsers.add_parser("showtimes", help="Check and time the showtime string parser against the strptime one.")
+    showtimes_parser.set_defaults(benchmark="showtimes")
+    showtimes_parser.add_argument("--repeats", type=int, default=50)
+    showtimes_parser.add_argument("--iterations", type=int, default=5)
+
+    scan_parser = subparsers.add_parser("scan", help="Record a scan's HTTP responses, or replay and time one.")
+    scan_parser.set_defaults(benchmark="scan")
+    scan_parser.add_argument("--archive", default="http-archive")
+    scan_parser.add_argument("--record", action="store_true", help="Record a fresh scan into the archive instead of replaying it.")
+    scan_parser.add_argument("--theater", action="append", dest="theaters", help="A theater to record. Defaults to MOVIE_VIEWER_THEATERS.")
+    scan_parser.add_argument("--days", type=int, default=30, help="How many days to record.")
+    scan_parser.add_argument("--seat-maps", action="store_true", help="Also record the Fandango seat maps.")
+    scan_parser.add_argument("--store", action="store_true", help="Also store the replayed showtimes, into the configured database.")
+    scan_parser.add_argument("--memory", action="store_true", help="Trace the replay's memory use and report its peak. Slows the replay down.")
+
+    store_parser = subparsers.add_parser("store", help="Check that storing showtimes day by day matches storing them all at once.")
+    store_parser.set_defaults(benchmark="store")
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main(parse_args())
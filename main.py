@@ -2,26 +2,22 @@ import itertools
 import os
 import sys
 from collections import defaultdict
-from datetime import date, datetime, timedelta, timezone
+from datetime import date, datetime, time, timezone
 from typing import Annotated, Any
 from zoneinfo import ZoneInfo
 
-from fastapi import Body, FastAPI, Cookie, Request, Response
+from fastapi import Body, FastAPI, Cookie, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from ical.calendar import Calendar
-from ical.calendar_stream import IcsCalendarStream
-from ical.event import Event
 from pydantic import BaseModel
 
-from retriever import db
-from retriever.movie_times_lib import collect_schedule, \
-        gather_fandango_screens_by_theater, gather_fandango_screens_new_showtimes, \
-        send_error_email, send_deletion_report, send_watchlist_notification
+from retriever import db, render
+from retriever.movie_times_lib import gather_fandango_screens, gather_fandango_screens_by_theater, \
+        gather_fandango_screens_new_showtimes, scan_showtimes, send_error_email, send_deletion_report, send_watchlist_notification
 from retriever.schedule import Filter, FullSchedule
-from retriever.utils import get_days_to_scan, offset_timezone
+from retriever.utils import get_scan_budget, offset_timezone
 
 
 app = FastAPI()
@@ -52,30 +48,22 @@ def _check_write_permission(client_id):
         raise RuntimeError("Unauthorized client.")
 
 
-def _showtimes_to_ics(showtimes):
-    calendar = Calendar()
+def _showtimes_to_ics_events(showtimes):
     for showtime in showtimes:
         description = showtime["format"]
         if showtime["programs"]:
-            description += ", ".join(sorted(showtime["programs"]))
-        calendar.events.append(
-            Event(
-                summary=showtime["title"],
-                description=description,
-                location=showtime["theater"],
-                start=showtime["start_time"],
-                end=showtime["end_time"]
-            )
-        )
+            description += ", " + ", ".join(sorted(showtime["programs"]))
+        yield render.IcsEvent(showtime["title"], showtime["start_time"], showtime["end_time"], description, showtime["theater"])
 
-    return IcsCalendarStream.calendar_to_ics(calendar)
+
+def _ics_response(showtimes):
+    return StreamingResponse(render.iter_ics(_showtimes_to_ics_events(showtimes)), media_type="text/calendar")
 
 
 def _load_visibility(theater, first_time, last_time, *, client_id):
     showtimes = _load_theater_showtimes(theater, first_time, last_time)
-    visibility = db.load_visibility(client_id=client_id) if client_id else {}
-
     titles = {s["title"] for s in showtimes}
+    visibility = db.load_visibility(titles, client_id=client_id) if client_id else {}
     return {title: visibility.get(title, True) for title in titles}
 
 
@@ -99,10 +87,21 @@ def read_root(request: Request, client_id: Annotated[str | None, Cookie()] = Non
     return templates.TemplateResponse(request=request, name="index.html", context=context)
 
 
+# Every filter is optional, and may be given more than once. Times are
+# wall-clock times at the theater.
 @app.get("/showtimes/{theater}/{first_time}/{last_time}")
-def request_showtimes(theater: str, first_time: datetime, last_time: datetime):
+def request_showtimes(theater: str, first_time: datetime, last_time: datetime,
+        earliest: time | None = None, latest: time | None = None,
+        movie: Annotated[list[str] | None, Query()] = None, not_movie: Annotated[list[str] | None, Query()] = None,
+        format: Annotated[list[str] | None, Query()] = None, not_format: Annotated[list[str] | None, Query()] = None,
+        language: Annotated[list[str] | None, Query()] = None, not_language: Annotated[list[str] | None, Query()] = None,
+        program: Annotated[list[str] | None, Query()] = None, not_program: Annotated[list[str] | None, Query()] = None,
+        screen: Annotated[list[str] | None, Query()] = None, not_screen: Annotated[list[str] | None, Query()] = None):
+    filter_params = Filter(earliest, latest, movie, not_movie, format, not_format,
+            languages=language, exclude_languages=not_language, programs=program, exclude_programs=not_program,
+            screens=screen, exclude_screens=not_screen)
     showtimes = _load_theater_showtimes(theater, first_time, last_time)
-    return {"showtimes": showtimes}
+    return {"showtimes": filter_params.filter_showtimes(showtimes)}
 
 @app.get("/showtimes/{theater}/{first_time}/{last_time}/visibility")
 def request_visibility(theater: str, first_time: datetime, last_time: datetime, client_id: Annotated[str | None, Cookie()] = None):
@@ -127,8 +126,7 @@ def request_show_movie(title, client_id: Annotated[str | None, Cookie()] = None)
 def request_export_ics(payload: dict[str, Any], client_id: Annotated[str | None, Cookie()] = None):
     _check_write_permission(client_id)
 
-    ics_stream = _showtimes_to_ics(payload["showtimes"])
-    return Response(content=ics_stream, media_type="text/calendar")
+    return _ics_response(payload["showtimes"])
 
 @app.get("/schedule/{first_time}/{last_time}")
 def load_schedule(first_time: datetime, last_time: datetime, client_id: Annotated[str | None, Cookie()] = None):
@@ -189,6 +187,10 @@ def request_theaters_last_updated():
 
     return {"updates": updates_in_local_tz}
 
+@app.get("/titles")
+def request_titles(query: str, limit: int = 20):
+    return {"titles": db.find_titles(query, limit)}
+
 @app.get("/watchlist")
 def request_watchlist(client_id: Annotated[str | None, Cookie()] = None):
     _check_write_permission(client_id)
@@ -211,28 +213,19 @@ def remove_from_watchlist(title: Annotated[str, Body(embed=True)], client_id: An
     db.remove_from_watchlist(title, client_id=client_id)
     return {}
 
-@app.get("/update-showtimes")
-def scan():
+def _scan(theaters):
     start_time = datetime.now(timezone.utc)
+    success = False
     try:
         print(f"Showtime scan starting at {datetime.now(timezone.utc)} UTC")
 
-        days_to_scan = get_days_to_scan()
-        theaters_to_scan = os.environ.get("MOVIE_VIEWER_THEATERS", "").split(",")
-        for theater in theaters_to_scan:
-            tz = offset_timezone(db.get_theater(theater)["tzname"])
-            today = datetime.now(tz).date()
-            date_range = (today, today + timedelta(days=days_to_scan))
+        budget = get_scan_budget()
+        success = scan_showtimes(theaters, start_time, budget)
 
-            print(f"Updating the showtimes for {theater} between {date_range[0].isoformat()} and {date_range[1].isoformat()}...")
-            schedule = collect_schedule(theater, None, date_range, Filter.empty(), True)
-            if schedule:
-                db.store_showtimes(schedule)
-
-        gather_fandango_screens_new_showtimes(start_time)
+        if datetime.now(timezone.utc) < start_time + budget:
+            gather_fandango_screens_new_showtimes(start_time, start_time + budget)
 
         print(f"Showtime scan completed at {datetime.now(timezone.utc)} UTC")
-        success = True
     except Exception as exc:
         send_error_email(exc)
         success = False
@@ -240,6 +233,14 @@ def scan():
         end_time = datetime.now(timezone.utc)
         db.log_task(db.Task.UPDATE_SHOWTIMES, start_time, end_time, success)
 
+@app.get("/update-showtimes")
+def scan():
+    _scan(os.environ.get("MOVIE_VIEWER_THEATERS", "").split(","))
+
+@app.get("/update-showtimes/{theater}")
+def scan_theater(theater: str):
+    _scan([theater])
+
 @app.get("/send-deletion-report")
 def scan_deletions():
     start_time = datetime.now(timezone.utc)
@@ -258,6 +259,19 @@ def send_watchlist_notifications():
     end_time = datetime.now(timezone.utc)
     db.log_task(db.Task.WATCHLIST_NOTIFICATIONS, start_time, end_time, success)
 
+@app.get("/gather-fandango-auditoriums")
+def run_gather_all_fandango_screens():
+    start_time = datetime.now(timezone.utc)
+
+    print(f"Gather Fandango auditoriums starting at {start_time} UTC")
+
+    success = gather_fandango_screens()
+
+    end_time = datetime.now(timezone.utc)
+    db.log_task(db.Task.GATHER_FANDANGO_SCREENS, start_time, end_time, success)
+
+    print(f"Completed gather Fandango auditoriums at {end_time} UTC")
+
 @app.get("/gather-fandango-auditoriums/{theater}")
 def run_gather_fandango_screens(theater: str):
     start_time = datetime.now(timezone.utc)
@@ -278,5 +292,4 @@ def schedule_rss(client_id: Annotated[str | None, Cookie()] = None, path_client_
     client_id = path_client_id or client_id
 
     schedule = db.load_whole_schedule(client_id=client_id)
-    ics_stream = _showtimes_to_ics(schedule)
-    return Response(content=ics_stream, media_type="text/calendar")
+    return _ics_response(schedule)
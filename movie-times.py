@@ -1,15 +1,13 @@
 import argparse
 import base64
 import os
+import sys
 
-from ical.calendar import Calendar
-from ical.calendar_stream import IcsCalendarStream
-from ical.event import Event
 from mailtrap import Address, Attachment, Mail, MailtrapClient
 
-from retriever import db
+from retriever import db, parsers
 from retriever.movie_times_lib import collect_schedule, \
-        email_theater_schedules, send_deletion_report, send_watchlist_notification
+        email_theater_schedules, send_deletion_report, send_watchlist_notification, store_schedule
 from retriever.schedule import Filter, FullSchedule, ParseError, \
         date_range_str_parser as _raw_date_parser, time_str_parser as _raw_time_parser
 
@@ -27,11 +25,7 @@ time_str_parser = _wrap_parser(_raw_time_parser)
 
 
 def db_main(theater, date_range, deletion_report=True, watchlist_notifications=True):
-    schedule = collect_schedule(theater, None, date_range, Filter.empty(), False)
-    if not schedule:
-        return
-
-    _, deleted_showings = db.store_showtimes(schedule)
+    _, deleted_showings = store_schedule(theater, date_range, False)
     if deletion_report and deleted_showings:
         send_deletion_report()
 
@@ -49,17 +43,26 @@ def cli_main(theater, filepath, date_range, name_only, date_only, filter_params)
     
     if schedule_range:
         print(end="\n\n")
-        print(schedule_range.output(name_only, date_only))
+        schedule_range.write(sys.stdout, name_only, date_only)
+        print()
         print(f"\n- {len(schedule_range)} showtimes")
 
-def main(args):
+def _run(args):
     if args.output == "cli":
-        filter_params = Filter(args.earliest, args.latest, args.movie, args.not_movie, args.format, args.not_format)
+        filter_params = Filter(args.earliest, args.latest, args.movie, args.not_movie, args.format, args.not_format,
+                languages=args.language, exclude_languages=args.not_language, programs=args.program, exclude_programs=args.not_program,
+                screens=args.screen, exclude_screens=args.not_screen)
         cli_main(args.theater, args.filepath, args.date_range, args.name_only, args.date_only, filter_params)
     elif args.output == "email":
         email_main(args.date_range, args.theaters, args.frm, args.from_name, args.to)
     elif args.output == "db":
         db_main(args.theater, args.date_range, args.deletion_report, args.watchlist_notifications)
+    elif args.output == "migrate":
+        db.backfill()
+
+def main(args):
+    with parsers.scan_run():
+        _run(args)
 
 
 def parse_args():
@@ -81,6 +84,12 @@ def parse_args():
     cli_parser.add_argument("--not-movie", action="append")
     cli_parser.add_argument("--format", "-f", action="append")
     cli_parser.add_argument("--not-format", action="append")
+    cli_parser.add_argument("--language", action="append")
+    cli_parser.add_argument("--not-language", action="append")
+    cli_parser.add_argument("--program", "-p", action="append")
+    cli_parser.add_argument("--not-program", action="append")
+    cli_parser.add_argument("--screen", action="append")
+    cli_parser.add_argument("--not-screen", action="append")
 
     email_parser = subparsers.add_parser("email", help="Email the result.")
     email_parser.set_defaults(output="email")
@@ -97,6 +106,9 @@ def parse_args():
     db_parser.add_argument("--deletion-report", action="store_true")
     db_parser.add_argument("--watchlist-notifications", action="store_true")
 
+    migrate_parser = subparsers.add_parser("migrate", help="Fill in the columns added to the database since its rows were stored.")
+    migrate_parser.set_defaults(output="migrate")
+
     return parser.parse_args()
 
 if __name__ == "__main__":
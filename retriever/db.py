@@ -1,8 +1,16 @@
 import json
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, time, timedelta, timezone
 from enum import StrEnum
 
-from retriever import orm
+from retriever import diff, orm
+from retriever.utils import title_key
+
+
+class ScanUnitStatus(StrEnum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    EXPIRED = "expired"
 
 
 class Task(StrEnum):
@@ -13,15 +21,25 @@ class Task(StrEnum):
 
 
 
+# Columns kept up to date from the others, for lookups. Cleaned rows leave
+# them out.
+_DERIVED_COLUMNS = diff.HASH_COLUMNS + ("title_key", )
+
+
 def _base_read_showtimes(raw_rows, *, clean=True):
     rows = []
     for row_dict in raw_rows:
-        rows.append(row_dict | {
+        row_dict = row_dict | {
             "programs": set(json.loads(row_dict["programs"] or "[]")),
             "extra_properties": json.loads(row_dict["extra_properties"] or "{}"),
             "start_time": datetime.fromisoformat(row_dict["start_time"]),
             "end_time": datetime.fromisoformat(row_dict["end_time"])
-        })
+        }
+        if clean:
+            for column in _DERIVED_COLUMNS:
+                row_dict.pop(column, None)
+
+        rows.append(row_dict)
     return rows
 
 
@@ -77,30 +95,28 @@ def load_deleted_showtimes_by_delete_time(first_delete_time, last_delete_time=No
     return _read_deleted_showtimes_query(raw_result, clean=clean)
 
 
+# Carries changes to showtimes over to the schedule entries made from them.
+# The format and start time are left as they were, and flagged instead if
+# they changed, so that the client can decide whether to follow.
 def _update_schedule(new_showtimes):
-    def pop_special_fields(showtime):
-        fields = ("format", "start_time")
-        return {field: showtime.pop(field, None) for field in fields}
+    special_fields = ("format", "start_time")
 
     if new_showtimes:
         new_showtime_dict = {showtime["id"]: showtime for showtime in new_showtimes}
         with orm.connection() as conn:
             raw_result = conn.select("schedule", where={"id": [("in", list(new_showtime_dict.keys()))]})
-            schedule = _read_schedule_query(raw_result)
+            schedule = _read_schedule_query(raw_result, clean=False)
 
             for showtime in schedule:
                 new_showtime = new_showtime_dict.get(showtime["id"])
                 if new_showtime:
-                    special_field_dict = pop_special_fields(showtime)
-                    new_special_field_dict = pop_special_fields(new_showtime)
-                    mismatched_fields = [field for field, value in special_field_dict.items() if new_special_field_dict[field] != value]
-                    new_showtime["mismatched_fields"] = mismatched_fields
-
-                    if showtime.get("screen") and not new_showtime.get("screen"):
-                        new_showtime["screen"] = showtime["screen"]
+                    mismatched_fields = [field for field in special_fields if new_showtime.get(field) != showtime[field]]
+                    new_entry = {k: v for k, v in new_showtime.items() if k not in special_fields + diff.HASH_COLUMNS}
+                    new_entry = diff.carry_over_screen(new_entry, showtime) | {"mismatched_fields": mismatched_fields}
+                    new_entry |= diff.hashes(showtime | new_entry)
 
-                    if showtime != new_showtime:
-                        conn.update("schedule", new_showtime, {"id": showtime["id"]})
+                    if new_entry["content_hash"] != diff.stored_hash(showtime) or mismatched_fields != showtime["mismatched_fields"]:
+                        conn.update("schedule", new_entry, {"id": showtime["id"]})
 
 
 def _schedule_to_dict(schedule):
@@ -114,6 +130,7 @@ def _schedule_to_dict(schedule):
                 "id": showing.id,
                 "theater": schedule.theater,
                 "title": movie.name,
+                "title_key": title_key(movie.name),
                 "format": showing.fmt,
                 "language": showing.language,
                 "start_time": showing.start,
@@ -125,6 +142,63 @@ def _schedule_to_dict(schedule):
     return new_showtimes
 
 
+# How many values go in one IN (...) lookup, to stay within the database's
+# limit on query parameters.
+_LOOKUP_BATCH_SIZE = 500
+
+
+def _deleted_copy(showtime, delete_time):
+    return {k: v for k, v in showtime.items() if k != "create_time"} | {"delete_time": delete_time}
+
+
+# The stored showtimes of one theater between first_day and last_day
+# (inclusive), along with any stored on other days under one of the given
+# IDs, i.e. showtimes that have since moved into the window.
+def _load_current_showtimes(conn, theater, first_day, last_day, ids):
+    where = {"theater": theater, "start_time": [("between", first_day, last_day + timedelta(days=1))]}
+    raw_rows = conn.select("showtimes", where=where)
+
+    window_ids = {row["id"] for row in raw_rows}
+    moved_ids = [id_ for id_ in ids if id_ not in window_ids]
+    for idx in range(0, len(moved_ids), _LOOKUP_BATCH_SIZE):
+        raw_rows.extend(conn.select("showtimes", where={"theater": theater, "id": [("in", moved_ids[idx:idx + _LOOKUP_BATCH_SIZE])]}))
+
+    return _read_showtimes_query(raw_rows, clean=False)
+
+
+# Brings the stored showtimes of one theater between first_day and last_day
+# (inclusive) in line with new_showtimes, which must cover that whole window.
+# A showtime that moved here from a day outside the window is matched by its
+# ID, and treated as changed. Returns the showtimes that were inserted.
+def _sync_showtimes(conn, theater, new_showtimes, first_day, last_day, now):
+    current_showtimes = _load_current_showtimes(conn, theater, first_day, last_day, [s["id"] for s in new_showtimes])
+    added, changed, removed = diff.diff_showtimes(new_showtimes, current_showtimes)
+
+    if changed:
+        # Showtimes whose details have been changed; they'll be re-inserted with the correct details below.
+        conn.insert("deleted_showtimes", [_deleted_copy(current, now) for _, current in changed])
+        conn.delete("showtimes", {"theater": theater, "id": [("in", [current["id"] for _, current in changed])]})
+
+    if removed:
+        # Pre-existing showtimes that have disappeared i.e. their ID no longer shows up.
+        conn.insert("deleted_showtimes", [_deleted_copy(s, now) for s in removed])
+        conn.delete("showtimes", {"theater": theater, "id": [("in", [s["id"] for s in removed])]})
+
+    to_insert = added + [new for new, _ in changed]
+    if to_insert:
+        # Either inserting new showtimes, or re-adding those whose details changed.
+        to_insert_with_timestamp = [showtime | {"create_time": now} for showtime in to_insert]
+        conn.insert("showtimes", to_insert_with_timestamp, conflict={("id", "theater"): None})
+
+    return to_insert
+
+
+def _load_stored_changes(now, clean):
+    showtimes = load_showtimes_by_create_time(now, order_by="title", clean=clean)
+    deleted_showtimes = load_deleted_showtimes_by_delete_time(now, order_by="title", clean=clean)
+    return showtimes, deleted_showtimes
+
+
 def store_showtimes(schedule, *, clean=True):
     new_showtimes = _schedule_to_dict(schedule)
 
@@ -133,70 +207,148 @@ def store_showtimes(schedule, *, clean=True):
         print("The list of new showtimes was empty. This is likely due to the showtimes found lacking IDs.")
         return [], []
 
+    now = datetime.now(timezone.utc).replace(microsecond=0)
     with orm.connection() as conn:
-        where = {"theater": schedule.theater, "start_time": [("between", schedule.start, schedule.end + timedelta(days=1))]}
-        current_showtimes_by_id = {s["id"]: s for s in _read_showtimes_query(conn.select("showtimes", where=where))}
+        to_insert = _sync_showtimes(conn, schedule.theater, new_showtimes, schedule.start, schedule.end, now)
 
-        now = datetime.now(timezone.utc).replace(microsecond=0)
-        to_insert, to_delete = [], []
-        for new_showtime in new_showtimes:
-            current_showtime = current_showtimes_by_id.pop(new_showtime["id"], None)
+    _update_schedule(to_insert)
+    return _load_stored_changes(now, clean)
 
-            # Fandango screens are added later. This ensures their omission
-            # during showtime retrieval isn't treated as a mismatch.
-            current_showtime_screen = current_showtime.get("screen") if current_showtime else None
-            if current_showtime_screen and not new_showtime.get("screen"):
-                new_showtime["screen"] = current_showtime_screen
 
-            if new_showtime != current_showtime:
-                to_insert.append(new_showtime)
-                if current_showtime:
-                    to_delete.append(current_showtime | {"delete_time": now})
+def store_showtimes_by_day(schedules, *, clean=True):
+    """Stores day schedules one at a time, as they're produced.
 
-        if to_delete:
-            # Showtimes whose details have been changed; they'll be re-inserted with the correct details below.
-            conn.insert("deleted_showtimes", to_delete)
-            conn.delete("showtimes", {"theater": schedule.theater, "id": [("in", [s["id"] for s in to_delete])]})
+    This has the same effect as storing them merged into one schedule, while
+    only ever holding one day's showtimes. Days without showtimes are held
+    back until a day with some comes along, so that (as with store_showtimes)
+    nothing is deleted when no showtimes were found at all. Days skipped over
+    between two stored days are synced along with the later one.
+    """
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    theater, unsynced_first_day, last_day = None, None, None
+    for schedule in schedules:
+        unsynced_first_day = unsynced_first_day or schedule.day
+        last_day = schedule.day
 
-        if current_showtimes_by_id:
-            # Pre-existing showtimes that have disappeared i.e. their ID no longer shows up.
-            conn.insert("deleted_showtimes", [s | {"delete_time": now} for s in current_showtimes_by_id.values()])
-            conn.delete("showtimes", {"theater": schedule.theater, "id": [("in", current_showtimes_by_id.keys())]})
+        new_showtimes = _schedule_to_dict(schedule)
+        if not new_showtimes:
+            continue
 
-        if to_insert:
-            # Either inserting new showtimes, or re-adding those whose details changed.
-            to_insert_with_timestamp = [showtime | {"create_time": now} for showtime in to_insert]
-            conn.insert("showtimes", to_insert_with_timestamp, conflict={("id", "theater"): None})
+        with orm.connection() as conn:
+            to_insert = _sync_showtimes(conn, schedule.theater, new_showtimes, unsynced_first_day, schedule.day, now)
+        _update_schedule(to_insert)
 
-    _update_schedule(to_insert)
+        theater = schedule.theater
+        unsynced_first_day = schedule.day + timedelta(days=1)
 
-    showtimes = load_showtimes_by_create_time(now, order_by="title", clean=clean)
-    deleted_showtimes = load_deleted_showtimes_by_delete_time(now, order_by="title", clean=clean)
-    return showtimes, deleted_showtimes
+    if not theater:
+        print("The list of new showtimes was empty. This is likely due to the showtimes found lacking IDs.")
+        return [], []
 
+    if unsynced_first_day <= last_day:
+        with orm.connection() as conn:
+            _sync_showtimes(conn, theater, [], unsynced_first_day, last_day, now)
+
+    return _load_stored_changes(now, clean)
+
+
+def load_theater_geos(codes):
+    if not codes:
+        return {}
 
-def update_screens(hash_to_auditorium):
     with orm.connection() as conn:
-        for hash_code, auditorium in hash_to_auditorium.items():
-            conn.update("showtimes", {"screen": auditorium}, {"extra_properties": [("like", f"%{hash_code}%")]})
-            conn.update("schedule", {"screen": auditorium}, {"extra_properties": [("like", f"%{hash_code}%")]})
+        raw_result = conn.select("theater_geo", ["code", "latitude", "longitude"], {"code": [("in", list(codes))]})
+    return {row["code"]: (row["latitude"], row["longitude"]) for row in raw_result}
 
 
-def load_visibility(*, client_id):
-    where = {"client": client_id}
+def store_theater_geos(geo_by_code, fetch_time):
+    with orm.connection() as conn:
+        for code, (latitude, longitude) in geo_by_code.items():
+            entry = {"latitude": latitude, "longitude": longitude, "fetch_time": fetch_time}
+            conn.insert("theater_geo", entry | {"code": code}, conflict={("code", ): entry})
+
+
+def load_fandango_screens(hashes):
+    if not hashes:
+        return {}
+
+    with orm.connection() as conn:
+        raw_result = conn.select("fandango_screen", ["hash", "auditorium"], {"hash": [("in", list(hashes))]})
+    return {row["hash"]: row["auditorium"] for row in raw_result}
+
+
+def store_fandango_screens(hash_to_auditorium, fetch_time):
+    entries = [{"hash": hash_code, "auditorium": str(auditorium), "fetch_time": fetch_time} for hash_code, auditorium in hash_to_auditorium.items()]
+    if not entries:
+        return
+
+    with orm.connection() as conn:
+        conn.insert("fandango_screen", entries, conflict={("hash", ): None})
+
+
+# Which of the given start hashes belong to one of the theater's current
+# showtimes.
+def find_showtime_start_hashes(theater, start_hashes):
+    _ensure_backfilled("hashes")
+    start_hashes = list(start_hashes)
+    found_hashes = set()
+    with orm.connection() as conn:
+        for idx in range(0, len(start_hashes), _LOOKUP_BATCH_SIZE):
+            where = {"theater": theater, "start_hash": [("in", start_hashes[idx:idx + _LOOKUP_BATCH_SIZE])]}
+            found_hashes.update(row["start_hash"] for row in conn.select("showtimes", ["start_hash"], where))
+    return found_hashes
+
+
+def update_screens(hash_to_auditorium):
+    # The screen is part of each showtime's content hash, so the hashes are
+    # recomputed along with it. The rows still missing a screen are read once
+    # per table and matched on the Fandango hash in their extra properties.
+    if not hash_to_auditorium:
+        return
+
+    with orm.connection() as conn:
+        for table, key_columns in _HASHED_TABLE_KEYS.items():
+            raw_result = conn.query(f"""SELECT * FROM {table}
+                WHERE (screen IS NULL OR screen = '') AND extra_properties LIKE {{ph}}""", ('%"hash"%', ))
+
+            rows = []
+            for showtime in _base_read_showtimes(raw_result, clean=False):
+                auditorium = hash_to_auditorium.get(showtime["extra_properties"].get("hash"))
+                if auditorium:
+                    assign = {"screen": auditorium} | diff.hashes(showtime | {"screen": auditorium})
+                    rows.append(assign | {column: showtime[column] for column in key_columns})
+            conn.update_many(table, rows, key_columns)
+
+
+# Whether each of the titles is visible. Hiding a movie hides it under every
+# spelling that shares its title key.
+def load_visibility(titles, *, client_id):
+    keys_by_title = {title: title_key(title) for title in titles}
+    if not keys_by_title:
+        return {}
+
+    _ensure_backfilled("title keys")
+    where = {"client": client_id, "title_key": [("in", list(set(keys_by_title.values())))], "hidden": 1}
     with orm.connection() as conn:
-        raw_result = conn.select("moviemetadata", columns=["title", "hidden"], where=where)
-    return {row["title"]: row["hidden"] == 0 for row in raw_result}
+        raw_result = conn.select("moviemetadata", columns=["title_key"], where=where)
+
+    hidden_keys = {row["title_key"] for row in raw_result}
+    return {title: key not in hidden_keys for title, key in keys_by_title.items()}
     
 
 def hide_movie(title, *, client_id):
+    _ensure_backfilled("title keys")
+    key = title_key(title)
     with orm.connection() as conn:
-        conn.insert("moviemetadata", {"title": title, "hidden": 1, "client": client_id}, conflict={("title", "client"): {"hidden": 1}})
+        conn.insert("moviemetadata", {"title": title, "title_key": key, "hidden": 1, "client": client_id},
+                    conflict={("title", "client"): {"title_key": key, "hidden": 1}})
+        conn.update("moviemetadata", {"hidden": 1}, {"title_key": key, "client": client_id})
 
 
 def show_movie(title, *, client_id):
+    _ensure_backfilled("title keys")
     with orm.connection() as conn:
-        conn.update("moviemetadata", {"hidden": 0}, {"title": title, "client": client_id})
+        conn.update("moviemetadata", {"hidden": 0}, {"title_key": title_key(title), "client": client_id})
 
 
 def load_schedule(first_time, last_time, *, client_id):
@@ -218,6 +370,7 @@ def add_to_schedule(showtime, *, client_id):
         "id": showtime["id"],
         "theater": showtime["theater"],
         "title": showtime["title"],
+        "title_key": title_key(showtime["title"]),
         "format": showtime["format"],
         "screen": showtime["screen"],
         "language": showtime["language"],
@@ -228,6 +381,7 @@ def add_to_schedule(showtime, *, client_id):
         "create_time": datetime.now(timezone.utc).replace(microsecond=0),
         "client": client_id
     }
+    entry |= diff.hashes(entry)
 
     with orm.connection() as conn:
         conn.insert("schedule", entry, conflict={("id", "theater", "client"): None})
@@ -310,6 +464,20 @@ def load_watchlist(client_id):
         return conn.select("watchlist", where=where, order_by="title")
 
 
+# Each date on which a watched title has showings at a theater that were
+# added between the two times, per client. Titles are matched by their keys,
+# so a theater's spelling of the title needn't match the watchlist's.
+def load_watchlist_matches(first_create_time, last_create_time):
+    query = """SELECT DISTINCT w.client, w.title, s.theater, SUBSTR(s.start_time, 1, 10) showdate
+        FROM watchlist w JOIN showtimes s ON s.title_key = w.title_key
+        WHERE s.create_time BETWEEN {ph} AND {ph}
+        ORDER BY w.client, w.title, s.theater, showdate"""
+    _ensure_backfilled("title keys")
+    with orm.connection() as conn:
+        raw_result = conn.query(query, (first_create_time, last_create_time))
+    return [row | {"showdate": date.fromisoformat(row["showdate"])} for row in raw_result]
+
+
 def load_all_watchlists():
     with orm.connection() as conn:
         return conn.select("watchlist", order_by="title")
@@ -318,7 +486,23 @@ def load_all_watchlists():
 def add_to_watchlist(title, *, client_id):
     entry = {"title": title, "client": client_id}
     with orm.connection() as conn:
-        conn.insert("watchlist", entry, conflict={tuple(entry.keys()): None})
+        conn.insert("watchlist", entry | {"title_key": title_key(title)}, conflict={tuple(entry.keys()): None})
+
+
+# Titles of current showtimes resembling the query, most similar first. This
+# is a trigram search where postgres has pg_trgm, and a substring search on
+# the title keys otherwise.
+def find_titles(query, limit=20):
+    _ensure_backfilled("title keys")
+    key = title_key(query)
+    with orm.connection() as conn:
+        if _has_trigram_index:
+            raw_result = conn.query("""SELECT title, MAX(similarity(title_key, {ph})) score FROM showtimes
+                WHERE title_key %% {ph} GROUP BY title ORDER BY score DESC, title LIMIT {ph}""", (key, key, limit))
+        else:
+            raw_result = conn.query("""SELECT DISTINCT title FROM showtimes
+                WHERE title_key LIKE {ph} ORDER BY title LIMIT {ph}""", (f"%{key}%", limit))
+    return [row["title"] for row in raw_result]
 
 
 def remove_from_watchlist(title, *, client_id):
@@ -348,7 +532,177 @@ def last_successful_task_run(name):
     return datetime.fromisoformat(last_run_str) if last_run_str else None
 
 
+def load_day_scan_times(theater, first_day, last_day):
+    where = {"theater": theater, "showdate": [("between", first_day, last_day)]}
+    with orm.connection() as conn:
+        raw_result = conn.select("day_scan", ["showdate", "scan_time"], where)
+    return {date.fromisoformat(row["showdate"]): datetime.fromisoformat(row["scan_time"]) for row in raw_result}
+
+
+def mark_days_scanned(theater, days, scan_time):
+    entries = [{"theater": theater, "showdate": day, "scan_time": scan_time} for day in days]
+    if not entries:
+        return
+
+    with orm.connection() as conn:
+        conn.insert("day_scan", entries, conflict={("theater", "showdate"): {"scan_time": scan_time}})
+
+
+def _read_scan_units_query(raw_rows):
+    rows = []
+    for row_dict in raw_rows:
+        rows.append(row_dict | {
+            "first_day": date.fromisoformat(row_dict["first_day"]),
+            "last_day": date.fromisoformat(row_dict["last_day"]),
+            "plan_time": datetime.fromisoformat(row_dict["plan_time"])
+        })
+    return rows
+
+
+def _scan_unit_key(unit):
+    return {"theater": unit["theater"], "first_day": unit["first_day"], "plan_time": unit["plan_time"]}
+
+
+def add_scan_units(units, plan_time):
+    entries = [{
+        "theater": unit["theater"],
+        "first_day": unit["first_day"],
+        "last_day": unit["last_day"],
+        "plan_time": plan_time,
+        "status": ScanUnitStatus.PENDING.value,
+        "attempts": 0
+    } for unit in units]
+    if not entries:
+        return
+
+    with orm.connection() as conn:
+        conn.insert("scan_unit", entries, conflict={("theater", "first_day", "plan_time"): None})
+
+
+def load_pending_scan_units(theaters):
+    where = {"status": ScanUnitStatus.PENDING.value, "theater": [("in", list(theaters))]}
+    with orm.connection() as conn:
+        raw_result = conn.select("scan_unit", where=where, order_by="first_day, plan_time, theater")
+    return _read_scan_units_query(raw_result)
+
+
+def complete_scan_unit(unit):
+    assign = {"status": ScanUnitStatus.DONE.value, "attempts": unit["attempts"] + 1, "update_time": datetime.now(timezone.utc), "error": None}
+    with orm.connection() as conn:
+        conn.update("scan_unit", assign, _scan_unit_key(unit))
+
+
+def fail_scan_unit(unit, error, max_attempts):
+    attempts = unit["attempts"] + 1
+    status = ScanUnitStatus.PENDING if attempts < max_attempts else ScanUnitStatus.FAILED
+    assign = {"status": status.value, "attempts": attempts, "update_time": datetime.now(timezone.utc), "error": str(error)}
+    with orm.connection() as conn:
+        conn.update("scan_unit", assign, _scan_unit_key(unit))
+
+
+def expire_scan_units(planned_before):
+    where = {"status": ScanUnitStatus.PENDING.value, "plan_time": [("<", planned_before)]}
+    with orm.connection() as conn:
+        conn.update("scan_unit", {"status": ScanUnitStatus.EXPIRED.value}, where)
+
+
+def load_projection_specifics(movie_detail_paths, fetched_after):
+    if not movie_detail_paths:
+        return {}
+
+    where = {"path": [("in", list(movie_detail_paths))], "fetch_time": [(">=", fetched_after)]}
+    with orm.connection() as conn:
+        raw_result = conn.select("projection_specifics", where=where)
+
+    projection_specifics = {}
+    for row_dict in raw_result:
+        raw_showtimes = json.loads(row_dict["showtimes"]) if row_dict["showtimes"] else None
+        projection_specifics[row_dict["path"]] = {
+            "format": row_dict["format"],
+            "showtimes": {date.fromisoformat(day): [time.fromisoformat(t) for t in times] for day, times in raw_showtimes.items()} if raw_showtimes is not None else None
+        }
+    return projection_specifics
+
+
+def store_projection_specifics(projection_specifics_by_path, fetch_time):
+    with orm.connection() as conn:
+        for path, projection_specifics in projection_specifics_by_path.items():
+            showtimes = projection_specifics["showtimes"]
+            entry = {
+                "path": path,
+                "format": projection_specifics["format"],
+                "showtimes": {day.isoformat(): [t.isoformat() for t in times] for day, times in showtimes.items()} if showtimes is not None else None,
+                "fetch_time": fetch_time
+            }
+            conn.insert("projection_specifics", entry, conflict={("path", ): {k: v for k, v in entry.items() if k != "path"}})
+
+
+# The tables whose rows carry content hashes, and the columns their rows are
+# updated by.
+_HASHED_TABLE_KEYS = {
+    "showtimes": ("id", "theater"),
+    "schedule": ("id", "theater", "client")
+}
+
+
+# The tables that are looked up by title key.
+_TITLE_KEYED_TABLES = ("showtimes", "watchlist", "moviemetadata")
+_has_trigram_index = False
+
+
+def _backfill_title_keys(conn, table):
+    titles = [row["title"] for row in conn.query(f"SELECT DISTINCT title FROM {table} WHERE title_key IS NULL")]
+    conn.update_many(table, [{"title_key": title_key(title), "title": title} for title in titles], ("title", ))
+    return len(titles)
+
+
+def _backfill_hashes(conn, table, key_columns):
+    showtimes = _base_read_showtimes(conn.query(f"SELECT * FROM {table} WHERE content_hash IS NULL"), clean=False)
+    conn.update_many(table, [diff.hashes(showtime) | {column: showtime[column] for column in key_columns} for showtime in showtimes], key_columns)
+    return len(showtimes)
+
+
+def _backfill_all_hashes(conn):
+    return {table: _backfill_hashes(conn, table, key_columns) for table, key_columns in _HASHED_TABLE_KEYS.items()}
+
+
+def _backfill_all_title_keys(conn):
+    return {table: _backfill_title_keys(conn, table) for table in _TITLE_KEYED_TABLES}
+
+
+_BACKFILLS = {"hashes": _backfill_all_hashes, "title keys": _backfill_all_title_keys}
+_backfilled = set()
+
+
+# Rows stored before the derived columns existed are filled in the first time
+# each process looks them up, rather than on import. Concurrent requests may
+# both run one, which only writes the same values twice.
+def _ensure_backfilled(kind):
+    if kind in _backfilled:
+        return
+
+    with orm.connection() as conn:
+        _BACKFILLS[kind](conn)
+    _backfilled.add(kind)
+
+
+def backfill():
+    """Fills in the derived columns of rows stored before those columns existed.
+
+    Lookups on those columns do this on their own the first time they run, so
+    this is only needed to get it over with ahead of time (see movie-times.py
+    migrate).
+    """
+    with orm.connection() as conn:
+        for kind, backfill_kind in _BACKFILLS.items():
+            for table, count in backfill_kind(conn).items():
+                print(f"{table}: backfilled {kind} ({count})")
+    _backfilled.update(_BACKFILLS)
+
+
 def _init_db():
+    global _has_trigram_index
+
     with orm.connection() as conn:
         cur = conn.db.cursor()
 
@@ -433,5 +787,82 @@ def _init_db():
             PRIMARY KEY(name, start_time)
         )""")
 
+        # The last time each of a theater's days was scanned. This drives the
+        # scan planner, which rescans far-off days less often than near ones.
+        cur.execute("""CREATE TABLE IF NOT EXISTS day_scan (
+            theater TEXT NOT NULL,
+            showdate TEXT NOT NULL,
+            scan_time TEXT NOT NULL,
+            PRIMARY KEY(theater, showdate)
+        )""")
+
+        # Checkpoints for the scan. Each scan is planned as a set of units,
+        # which are worked through across as many invocations as it takes.
+        cur.execute("""CREATE TABLE IF NOT EXISTS scan_unit (
+            theater TEXT NOT NULL,
+            first_day TEXT NOT NULL,
+            last_day TEXT NOT NULL,
+            plan_time TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            update_time TEXT,
+            error TEXT,
+            PRIMARY KEY(theater, first_day, plan_time)
+        )""")
+
+        # Where each Fandango theater is, as read from Fandango's own
+        # payloads, so its time zone can be resolved without asking again.
+        cur.execute("""CREATE TABLE IF NOT EXISTS theater_geo (
+            code TEXT PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            fetch_time TEXT NOT NULL
+        )""")
+
+        # The auditorium of each Fandango showtime whose seat map has been
+        # read, so it never needs to be requested again.
+        cur.execute("""CREATE TABLE IF NOT EXISTS fandango_screen (
+            hash TEXT PRIMARY KEY,
+            auditorium TEXT NOT NULL,
+            fetch_time TEXT NOT NULL
+        )""")
+
+        # Which of Coolidge's showtimes for a film are actually projected on
+        # film, keyed by the film's detail page.
+        cur.execute("""CREATE TABLE IF NOT EXISTS projection_specifics (
+            path TEXT PRIMARY KEY,
+            format TEXT NOT NULL,
+            showtimes TEXT,
+            fetch_time TEXT NOT NULL
+        )""")
+
+        # Hashes of each showtime's content, with and without its end time
+        # (see retriever.diff). Deleted showtimes keep the hashes they had,
+        # though ones deleted before these columns existed have none.
+        for table in ("showtimes", "deleted_showtimes", "schedule"):
+            for column in diff.HASH_COLUMNS:
+                conn.add_column(table, column, "TEXT")
+
+        cur.execute("CREATE INDEX IF NOT EXISTS showtimes_create_time_idx ON showtimes(create_time)")
+        cur.execute("CREATE INDEX IF NOT EXISTS watchlist_title_idx ON watchlist(title)")
+
+        cur.execute("CREATE INDEX IF NOT EXISTS showtimes_content_hash_idx ON showtimes(content_hash)")
+        cur.execute("CREATE INDEX IF NOT EXISTS showtimes_start_hash_idx ON showtimes(theater, start_hash)")
+        cur.execute("CREATE INDEX IF NOT EXISTS schedule_content_hash_idx ON schedule(content_hash)")
+
+        # A normalized form of each title (see utils.title_key), so that
+        # theaters' differing spellings of a title can be matched up. It's
+        # carried along wherever showtimes are copied.
+        for table in _TITLE_KEYED_TABLES + ("deleted_showtimes", "schedule"):
+            conn.add_column(table, "title_key", "TEXT")
+
+        cur.execute("CREATE INDEX IF NOT EXISTS showtimes_title_key_idx ON showtimes(title_key)")
+        cur.execute("CREATE INDEX IF NOT EXISTS watchlist_title_key_idx ON watchlist(title_key)")
+        cur.execute("CREATE INDEX IF NOT EXISTS moviemetadata_title_key_idx ON moviemetadata(client, title_key)")
+
+        if conn.create_extension("pg_trgm"):
+            cur.execute("CREATE INDEX IF NOT EXISTS showtimes_title_key_trgm_idx ON showtimes USING GIN (title_key gin_trgm_ops)")
+            _has_trigram_index = True
+
 
 _init_db()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+
+# The fields that make up a showtime's content. Anything else on a row (its
+# create or delete time, the client of a schedule entry, ...) is bookkeeping.
+CONTENT_FIELDS = ("id", "theater", "title", "format", "language", "start_time", "end_time", "programs", "screen", "extra_properties")
+HASH_COLUMNS = ("content_hash", "start_hash")
+
+ShowtimeDiff = namedtuple("ShowtimeDiff", ["added", "changed", "removed"])
+
+
+def _canonical_value(field, value):
+    if field == "programs":
+        return sorted(value or [])
+    elif field in ("start_time", "end_time"):
+        # Schedule entries come back from the frontend as strings.
+        return (value if isinstance(value, datetime) else datetime.fromisoformat(value)).isoformat()
+    elif field == "extra_properties":
+        return value or {}
+    else:
+        # Parsers aren't consistent about reporting a missing value as None or "".
+        return value or None
+
+
+def _hash(showtime, fields):
+    canonical = {field: _canonical_value(field, showtime.get(field)) for field in fields}
+    canonical_str = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical_str.encode(), digest_size=16).hexdigest()
+
+
+def content_hash(showtime):
+    return _hash(showtime, CONTENT_FIELDS)
+
+
+# Some theaters don't list runtimes, so their showtimes end when they start
+# until one turns up. This ignores the end, so that such a showtime and the
+# same one with a runtime can be told apart from an actual change.
+def start_hash(showtime):
+    return _hash(showtime, [field for field in CONTENT_FIELDS if field != "end_time"])
+
+
+def hashes(showtime):
+    return {"content_hash": content_hash(showtime), "start_hash": start_hash(showtime)}
+
+
+def with_hashes(showtime):
+    return showtime | hashes(showtime)
+
+
+# Rows stored before the hash columns existed may not have them.
+def stored_hash(showtime, column="content_hash"):
+    return showtime.get(column) or hashes(showtime)[column]
+
+
+# Fandango screens are added later, once their seat maps have been read. This
+# ensures their omission during showtime retrieval isn't treated as a change.
+def carry_over_screen(new_showtime, current_showtime):
+    current_screen = current_showtime.get("screen") if current_showtime else None
+    if current_screen and not new_showtime.get("screen"):
+        return new_showtime | {"screen": current_screen}
+    return new_showtime
+
+
+# Compares freshly retrieved showtimes with the stored ones, matched by ID.
+# The new showtimes are returned with the screen carry-over applied and their
+# hashes attached; changed pairs are (new, current).
+def diff_showtimes(new_showtimes, current_showtimes):
+    current_showtimes_by_id = {s["id"]: s for s in current_showtimes}
+
+    added, changed = [], []
+    for new_showtime in new_showtimes:
+        current_showtime = current_showtimes_by_id.pop(new_showtime["id"], None)
+        new_showtime = with_hashes(carry_over_screen(new_showtime, current_showtime))
+
+        if not current_showtime:
+            added.append(new_showtime)
+        elif new_showtime["content_hash"] != stored_hash(current_showtime):
+            changed.append((new_showtime, current_showtime))
+
+    return ShowtimeDiff(added, changed, list(current_showtimes_by_id.values()))
+
+
+# A deleted showtime without a runtime may only have been replaced by the
+# same showtime with its end time filled in.
+def may_be_runtime_update(showtime):
+    return showtime["start_time"] == showtime["end_time"]
+
+
+# Drops the deleted showtimes that were only runtime updates, given the start
+# hashes of the current showtimes (only those of candidates are needed).
+def true_deletions(deleted_showtimes, current_start_hashes):
+    filtered_deleted_showtimes = []
+    for showtime in deleted_showtimes:
+        if may_be_runtime_update(showtime) and stored_hash(showtime, "start_hash") in current_start_hashes:
+            print(f"SKIPPING {showtime}")
+            continue
+
+        filtered_deleted_showtimes.append(showtime)
+    return filtered_deleted_showtimes
@@ -0,0 +1,186 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from retriever.utils import get_http_archive, get_http_mode
+
+REQUEST_TIMEOUT = 30
+HTTP_MODES = ("live", "record", "replay")
+
+# Shared so repeated requests (e.g. hundreds of seat maps) reuse connections.
+_session = requests.Session()
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+class ReplayMissError(LookupError):
+    def __init__(self, url):
+        super().__init__(f"No recorded response for {url}. Record the scan again to include it.")
+        self.url = url
+
+
+# A response read back from (or just written to) the archive. It offers the
+# parts of the requests and httpx responses the parsers use.
+class RecordedResponse:
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get("content-type", "")
+        for param in content_type.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset" and value:
+                return value.strip('"')
+        return "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+# Every response body is stored once, gzipped, under the hash of its content.
+# The index maps each requested URL to its latest response, one JSON line per
+# recording, so an archive can be recorded into again.
+class HttpArchive:
+    def __init__(self, path):
+        self.path = path
+        self.blobs_path = os.path.join(path, "blobs")
+        self.index_path = os.path.join(path, "index.jsonl")
+        self._lock = threading.Lock()
+        self._index = None
+        self.hits = 0
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as index_file:
+                    for line in index_file:
+                        entry = json.loads(line)
+                        self._index[entry["url"]] = entry
+        return self._index
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blobs_path, digest[:2], f"{digest}.gz")
+
+    def record(self, url, status_code, headers, content):
+        digest = hashlib.sha256(content).hexdigest()
+        entry = {"url": url, "status": status_code, "headers": dict(headers), "sha256": digest}
+        with self._lock:
+            blob_path = self._blob_path(digest)
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                with gzip.open(f"{blob_path}.tmp", "wb") as blob_file:
+                    blob_file.write(content)
+                os.replace(f"{blob_path}.tmp", blob_path)
+
+            self._load_index()[url] = entry
+            with open(self.index_path, "a") as index_file:
+                index_file.write(json.dumps(entry) + "\n")
+
+        return RecordedResponse(url, status_code, headers, content)
+
+    def replay(self, url):
+        with self._lock:
+            entry = self._load_index().get(url)
+            if not entry:
+                raise ReplayMissError(url)
+            self.hits += 1
+
+        with gzip.open(self._blob_path(entry["sha256"]), "rb") as blob_file:
+            content = blob_file.read()
+        return RecordedResponse(url, entry["status"], entry["headers"], content)
+
+
+def http_mode():
+    mode = get_http_mode()
+    if mode not in HTTP_MODES:
+        raise ValueError(f"MOVIE_VIEWER_HTTP_MODE must be one of: {', '.join(HTTP_MODES)}. Got: {mode}")
+    return mode
+
+def get_archive():
+    global _archive
+    with _archive_lock:
+        path = get_http_archive()
+        if _archive is None or _archive.path != path:
+            os.makedirs(path, exist_ok=True)
+            _archive = HttpArchive(path)
+        return _archive
+
+
+# Every request the parsers make goes through here (or AsyncFetcher), so that
+# a scan can be recorded into the archive, and later replayed from it without
+# touching the network.
+def get(url, headers=None, *, stream=False, timeout=REQUEST_TIMEOUT):
+    mode = http_mode()
+    if mode == "replay":
+        return get_archive().replay(url)
+
+    response = _session.get(url, headers=headers, stream=stream and mode == "live", timeout=timeout)
+    if mode == "record":
+        return get_archive().record(url, response.status_code, response.headers, response.content)
+    return response
+
+
+# Shares one HTTP client across every request made during a scan. The
+# semaphore caps the number of requests in flight across all theaters, so a
+# parser issuing a request per day can't starve the rest or get the scanner
+# rate limited.
+class AsyncFetcher:
+    def __init__(self, max_concurrency):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = httpx.AsyncClient(follow_redirects=True, timeout=REQUEST_TIMEOUT)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.client.aclose()
+
+    async def get(self, url, headers=None):
+        mode = http_mode()
+        if mode == "replay":
+            return get_archive().replay(url)
+
+        async with self.semaphore:
+            response = await self.client.get(url, headers=headers)
+        if mode == "record":
+            return get_archive().record(url, response.status_code, response.headers, response.content)
+        return response
+
+    async def get_text(self, url, headers=None):
+        response = await self.get(url, headers=headers)
+        return response.text
+
+    async def get_json(self, url, headers=None):
+        response = await self.get(url, headers=headers)
+        try:
+            return response.json()
+        except ValueError:
+            raise ValueError(f"Request to {url} did not return JSON. Got: {response.text}")
+
+    async def run_sync(self, func, *args, **kwargs):
+        # Parsers that haven't moved to the async protocol still block on
+        # their own requests, so they run on a worker thread. They hold a slot
+        # while doing so, to keep them within the overall limit.
+        async with self.semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
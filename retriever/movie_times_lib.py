@@ -1,24 +1,30 @@
-import base64
-import importlib
+import asyncio
 import json
 import os
 import traceback
-from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 
-from ical.calendar import Calendar
-from ical.calendar_stream import IcsCalendarStream
-from ical.event import Event
 from mailtrap import Address, Attachment, Mail, MailtrapClient
 
-from retriever import db
-from retriever.parsers import brattle, coolidge, fandango_json, red_river, somerville_theater
-from retriever.schedule import Filter, FullSchedule, ParseError
+from retriever import db, diff, render
+from retriever.fetch import AsyncFetcher
+from retriever.scan_planner import NEAR_TIER_DAYS, due_date_ranges
+from retriever import parsers
+from retriever.parsers import fandango_json
+from retriever.schedule import FullSchedule, ParseError
 from retriever.utils import JsonEncoder, date_ranges, date_range_to_str, \
-        get_days_to_scan, group_dict_by, group_obj_by, offset_timezone
+        get_days_to_scan, get_scan_concurrency, group_dict_by, group_obj_by, offset_timezone
 
 MAILTRAP_EMAIL_SIZE_LIMIT = 10485760
+# The most JSON that still fits within Mailtrap's limit once base64-encoded.
+DELETION_REPORT_ATTACHMENT_SIZE = MAILTRAP_EMAIL_SIZE_LIMIT // 4 * 3
+
+SCAN_UNIT_DAYS = 7
+MAX_SCAN_UNIT_ATTEMPTS = 3
+# Units left over from a plan this old are dropped rather than resumed, since
+# the planner will have covered those days again by then.
+SCAN_UNIT_EXPIRY = timedelta(days=1)
 
 
 def task(func):
@@ -32,37 +38,32 @@ def task(func):
             return False
     return wrapper
 
+# Renders an attachment by having write_content write it to a stream, which
+# base64-encodes it as it goes.
+def _render_attachment(write_content, filename, *, encoding="utf-8"):
+    encoder = render.Base64Writer(MAILTRAP_EMAIL_SIZE_LIMIT, encoding)
+    try:
+        write_content(encoder)
+    except render.SizeLimitError as exc:
+        raise ValueError("The size of the attachment exceeds MailTrap's size limit.") from exc
+
+    return Attachment(content=encoder.getvalue(), filename=filename)
+
 def _build_attachment(content, filename, *, encoding="utf-8"):
-    content = base64.b64encode(content.encode(encoding))
-    if len(content) > MAILTRAP_EMAIL_SIZE_LIMIT:
-        raise ValueError("The size of the attachment exceeds MailTrap's size limit.")
+    return _render_attachment(lambda out: out.write(content), filename, encoding=encoding)
 
-    return Attachment(content=content, filename=filename)
+def _schedule_ics_events(schedule):
+    for movie in schedule.movies:
+        for showing in sorted(movie.showings, key=lambda s: s.start):
+            yield render.IcsEvent(movie.name, showing.start, showing.end or (showing.start + timedelta(minutes=5)))
 
 def _ics_attachments(schedules):
-    attachments = []
-    for schedule in schedules:
-        calendar = Calendar()
-        for movie in schedule.movies:
-            for showing in movie.showings:
-                start = showing.start
-                end = showing.end or (start + timedelta(minutes=5))
-                calendar.events.append(
-                    Event(summary=movie.name, start=start, end=end),
-                )
-
-        calendar_ics = IcsCalendarStream.calendar_to_ics(calendar)
-        attachments.append(_build_attachment(calendar_ics, f"{schedule.theater}.ics"))
-
-    return attachments
+    return [_render_attachment(lambda out: render.write_ics(_schedule_ics_events(schedule), out), f"{schedule.theater}.ics")
+            for schedule in schedules]
 
 def _plaintext_attachments(schedules):
-    attachments = []
-    for schedule in schedules:
-        schedule_text = schedule.output(name_only=False, date_only=True)
-        attachments.append(_build_attachment(schedule_text, f"{schedule.theater}.txt"))
-
-    return attachments
+    return [_render_attachment(lambda out: schedule.write(out, name_only=False, date_only=True), f"{schedule.theater}.txt")
+            for schedule in schedules]
 
 def _send_email(subject, text, sender=None, sender_name=None, receiver=None, attachments=[]):
     sender = sender or os.environ.get("MAILTRAP_SENDER")
@@ -82,6 +83,7 @@ def _send_email(subject, text, sender=None, sender_name=None, receiver=None, att
 
 
 def email_theater_schedules(schedules, dates, sender, sender_name, receiver):
+    schedules = [schedule for schedule in schedules if schedule]
     attachments = _plaintext_attachments(schedules) + _ics_attachments(schedules)
 
     subject = f"Movie Schedules {dates[0].isoformat()}"
@@ -91,118 +93,247 @@ def email_theater_schedules(schedules, dates, sender, sender_name, receiver):
     _send_email(subject, "Schedules attached", sender, sender_name, receiver, attachments)
 
 
+def _build_full_schedule(raw_schedules, date_range, filter_params):
+    filtered_schedules = [schedule.filter(filter_params) for schedule in raw_schedules]
+
+    if not filtered_schedules:
+        date_range_str = ' - '.join(d.isoformat() for d in date_range)
+        print(f"[WARN] Could not find any data for the requested date(s): {date_range_str}")
+        return
+
+    return FullSchedule.create(filtered_schedules)
+
+
 def collect_schedule(theater, filepath, date_range, filter_params, quiet):
     theater_info = db.get_theater(theater)
     if not theater_info:
         print(f"[ERROR] No theater found with the name {theater}. Has it been added?")
         return
 
-    parser = importlib.import_module(f"retriever.parsers.{theater_info['parser']}")
-    raw_schedules = parser.load_schedules_by_day(theater_info, date_range, quiet)
+    raw_schedules = parsers.load_schedules_by_day(theater_info, date_range, quiet)
+    return _build_full_schedule(raw_schedules, date_range, filter_params)
 
-    filtered_schedules = [schedule.filter(filter_params) for schedule in raw_schedules]
 
-    if not filtered_schedules:
-        date_range_str = ' - '.join(d.isoformat() for d in date_range)
-        print(f"[WARN] Could not find any data for the requested date(s): {date_range_str}")
+# Streams a theater's schedule into the DB a day at a time, for the parsers
+# that can produce it that way.
+def store_schedule(theater, date_range, quiet):
+    theater_info = db.get_theater(theater)
+    if not theater_info:
+        print(f"[ERROR] No theater found with the name {theater}. Has it been added?")
+        return [], []
+
+    raw_schedules = parsers.iter_schedules_by_day(theater_info, date_range, quiet)
+    return db.store_showtimes_by_day(raw_schedules)
+
+
+async def _load_day_schedules_async(theater, date_range, quiet, fetcher):
+    theater_info = db.get_theater(theater)
+    if not theater_info:
+        print(f"[ERROR] No theater found with the name {theater}. Has it been added?")
         return
 
-    return FullSchedule.create(filtered_schedules)
+    return await parsers.load_schedules_by_day_async(theater_info, date_range, quiet, fetcher=fetcher)
 
 
-@task
-def send_watchlist_notification():
-    last_time = datetime.now()
+async def _collect_day_schedules_async(scan_requests, quiet, return_exceptions):
+    async with AsyncFetcher(get_scan_concurrency()) as fetcher:
+        loaders = [_load_day_schedules_async(theater, date_range, quiet, fetcher) for theater, date_range in scan_requests]
+        return await asyncio.gather(*loaders, return_exceptions=return_exceptions)
 
-    first_time = db.last_successful_task_run(db.Task.WATCHLIST_NOTIFICATIONS) or (last_time - timedelta(days=365))
 
-    stored_showings = db.load_showtimes_by_create_time(first_time, last_time)
+# Loads the unfiltered day schedules for many (theater, date range) pairs at
+# once, on a single event loop. The results are in the same order as the
+# requests, with None for theaters that couldn't be found.
+def collect_day_schedules(scan_requests, quiet, *, return_exceptions=False):
+    return asyncio.run(_collect_day_schedules_async(scan_requests, quiet, return_exceptions))
+
+
+# As collect_day_schedules, but filtered and merged into one schedule per
+# request, as collect_schedule would return it.
+def collect_schedules(scan_requests, filter_params, quiet, *, return_exceptions=False):
+    all_raw_schedules = collect_day_schedules(scan_requests, quiet, return_exceptions=return_exceptions)
+    return [raw_schedules if raw_schedules is None or isinstance(raw_schedules, Exception) else _build_full_schedule(raw_schedules, date_range, filter_params)
+            for raw_schedules, (_, date_range) in zip(all_raw_schedules, scan_requests)]
 
-    showdates_by_title = defaultdict(lambda: defaultdict(set))
-    for showing in stored_showings:
-        showdate = showing["start_time"].date()
-        showdates_by_title[showing["title"]][showing["theater"]].add(showdate)
 
-    watched = db.load_all_watchlists()
-    for client_id, entries in group_dict_by(watched, "client").items():
-        lines = []
-        for entry in entries:
-            title = entry["title"]
-            showdates_by_theater = showdates_by_title.get(title, {})
-            if showdates_by_theater:
-                lines.append(f"Showings added for {title}:")
-                for theater, showdates in showdates_by_theater.items():
-                    showdate_ranges = date_ranges(showdates)
-                    showdates_str = ", ".join(date_range_to_str(dr) for dr in showdate_ranges)
-                    lines.append(f"- {theater}: {showdates_str}")
+def _split_date_range(date_range, max_days):
+    first_day, last_day = date_range
+    while first_day <= last_day:
+        unit_last_day = min(first_day + timedelta(days=max_days - 1), last_day)
+        yield first_day, unit_last_day
+        first_day = unit_last_day + timedelta(days=1)
 
-        if lines:
-            msg = "\n".join(lines)
-            _send_email("Watchlist notification", msg, receiver=None)
 
-def _true_deletion_filter(deleted_showtimes, current_showtimes):
-    def _drop_key(adict, key):
-        return {k: v for k, v, in adict.items() if k != key}
+def _unit_days(unit):
+    day_count = (unit["last_day"] - unit["first_day"]).days + 1
+    return [unit["first_day"] + timedelta(days=offset) for offset in range(day_count)]
 
-    current_without_end = [_drop_key(showtime, "end_time") for showtime in current_showtimes]
 
-    filtered_deleted_showtimes = []
-    for showtime_dict in deleted_showtimes:
-        if showtime_dict["start_time"] == showtime_dict["end_time"] and _drop_key(showtime_dict, "end_time") in current_without_end:
-            print(f"SKIPPING {showtime_dict}")
-            continue
+# Theaters with units still pending from an earlier plan only have their near
+# days planned, and only those that the pending units don't already cover.
+def _plan_scan_units(theaters, plan_time, pending_units):
+    days_to_scan = get_days_to_scan()
+    pending_days = {theater: {day for unit in units for day in _unit_days(unit)}
+                    for theater, units in group_dict_by(pending_units, "theater").items()}
 
-        filtered_deleted_showtimes.append(showtime_dict)
+    units = []
+    for theater in theaters:
+        tz = offset_timezone(db.get_theater(theater)["tzname"])
+        today = datetime.now(tz).date()
 
-    return filtered_deleted_showtimes
+        if theater in pending_days:
+            due_ranges = due_date_ranges(theater, today, plan_time, min(NEAR_TIER_DAYS, days_to_scan), pending_days[theater])
+        else:
+            due_ranges = due_date_ranges(theater, today, plan_time, days_to_scan)
+            if not due_ranges:
+                print(f"No days are due to be scanned for {theater}.")
 
-@task
-def send_deletion_report():
-    def _start_range(showtimes):
-        dts = sorted([s["start_time"] for s in showtimes])
-        start = dts[0].replace(hour=0, minute=0, second=0, microsecond=0)
-        end = dts[-1].replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        return start, end
+        for date_range in due_ranges:
+            for first_day, last_day in _split_date_range(date_range, SCAN_UNIT_DAYS):
+                units.append({"theater": theater, "first_day": first_day, "last_day": last_day})
 
-    last_time = datetime.now()
-    first_time = db.last_successful_task_run(db.Task.DELETION_REPORT) or (last_time - timedelta(days=365))
+    db.add_scan_units(units, plan_time)
 
-    all_deleted_showtimes = db.load_deleted_showtimes_by_delete_time(first_time, last_time, order_by="title")
-    deleted_showtimes_by_theater = group_dict_by(all_deleted_showtimes, "theater")
-    filtered_deleted_showtimes = []
-    for theater, deleted_showtimes in deleted_showtimes_by_theater.items():
-        deleted_showtimes = [{**s, "programs": list(s.get("programs", set()))} for s in deleted_showtimes]
-        theater_showtimes = db.load_showtimes(*_start_range(deleted_showtimes), theater=theater)
-        filtered_deleted_showtimes.extend(_true_deletion_filter(deleted_showtimes, theater_showtimes))
 
-        if not filtered_deleted_showtimes:
-            return True
+def _scan_unit(unit, schedules, scan_time):
+    if schedules:
+        db.store_showtimes_by_day(schedules)
+
+    db.mark_days_scanned(unit["theater"], _unit_days(unit), scan_time)
+    db.complete_scan_unit(unit)
+
+
+# Works through the theaters' pending scan units until they run out or the
+# time budget does. A theater is only planned in full once its previous units
+# are all finished, so a scan cut short by the deadline resumes where it left
+# off on the next invocation. Units are run in waves of one per theater, each
+# theater's nearest days first.
+def _scan_showtimes(theaters, start_time, budget):
+    deadline = start_time + budget
+    db.expire_scan_units(start_time - SCAN_UNIT_EXPIRY)
+
+    _plan_scan_units(theaters, start_time, db.load_pending_scan_units(theaters))
+    pending_units = db.load_pending_scan_units(theaters)
+
+    success = True
+    longest_wave = timedelta(0)
+    while pending_units:
+        wave_start = datetime.now(timezone.utc)
+        if wave_start + longest_wave > deadline:
+            print(f"Out of time with {len(pending_units)} scan unit(s) remaining. They'll be resumed on the next run.")
+            break
+
+        # The units are loaded nearest first, so each theater's first is the
+        # one it runs.
+        wave = {}
+        for unit in pending_units:
+            wave.setdefault(unit["theater"], unit)
+        wave = list(wave.values())
+
+        scan_requests = [(unit["theater"], (unit["first_day"], unit["last_day"])) for unit in wave]
+        for theater, date_range in scan_requests:
+            print(f"Updating the showtimes for {theater} between {date_range[0].isoformat()} and {date_range[1].isoformat()}...")
+
+        all_schedules = collect_day_schedules(scan_requests, True, return_exceptions=True)
+        for unit, schedules in zip(wave, all_schedules):
+            try:
+                if isinstance(schedules, Exception):
+                    raise schedules
+                _scan_unit(unit, schedules, start_time)
+            except Exception as exc:
+                success = False
+                send_error_email(exc)
+                db.fail_scan_unit(unit, exc, MAX_SCAN_UNIT_ATTEMPTS)
 
-        chunk_size = 20000
-        chunks = [filtered_deleted_showtimes[idx:idx + chunk_size] for idx in range(0, len(filtered_deleted_showtimes), chunk_size)]
+        # Failed units stay pending, but are left for the next invocation.
+        pending_units = [unit for unit in pending_units if unit not in wave]
+        longest_wave = max(longest_wave, datetime.now(timezone.utc) - wave_start)
+
+    return success
+
+
+def scan_showtimes(theaters, start_time, budget):
+    # A whole-feed theater's units come up in separate waves, but its feed is
+    # only loaded in the first of them.
+    with parsers.scan_run():
+        return _scan_showtimes(theaters, start_time, budget)
 
-        for idx, showtimes_chunk in enumerate(chunks, start=1):
-            # deleted_showtimes_json = "[\n" + ",\n".join([f"  {json.dumps(_showtime_to_json(s), sort_keys=True)}" for s in showtimes_chunk]) + "\n]"
-            filename = f"deleted-{idx}.json" if len(chunks) > 1 else "deleted.json"
-            deleted_showtimes_json = json.dumps(showtimes_chunk, sort_keys=True, cls=JsonEncoder)
-            deleted_attachment = _build_attachment(deleted_showtimes_json, filename)
 
-            subject = f"Schedule Updater Deletion Report ({date_range_to_str([first_time, last_time])})"
-            msg = "Deletion report attached" + (f" ({idx} / {len(chunks)})" if len(chunks) > 1 else "")
-            _send_email(subject, msg,  attachments=[deleted_attachment])
-        return True
+@task
+def send_watchlist_notification():
+    last_time = datetime.now()
+
+    first_time = db.last_successful_task_run(db.Task.WATCHLIST_NOTIFICATIONS) or (last_time - timedelta(days=365))
 
-    chunk_size = 20000
-    chunks = [filtered_deleted_showtimes[idx:idx + chunk_size] for idx in range(0, len(filtered_deleted_showtimes), chunk_size)]
+    matches = db.load_watchlist_matches(first_time, last_time)
+    for client_id, client_matches in group_dict_by(matches, "client").items():
+        lines = []
+        for title, title_matches in group_dict_by(client_matches, "title").items():
+            lines.append(f"Showings added for {title}:")
+            for theater, theater_matches in group_dict_by(title_matches, "theater").items():
+                showdate_ranges = date_ranges(m["showdate"] for m in theater_matches)
+                showdates_str = ", ".join(date_range_to_str(dr) for dr in showdate_ranges)
+                lines.append(f"- {theater}: {showdates_str}")
+
+        msg = "\n".join(lines)
+        _send_email("Watchlist notification", msg, receiver=None)
+
+def _report_row(deleted_showtime):
+    row = {k: v for k, v in deleted_showtime.items() if k not in ("delete_time", "title_key") + diff.HASH_COLUMNS}
+    return row | {"programs": sorted(row["programs"])}
+
+# Writes the rows out as JSON lists, starting a new attachment whenever the
+# current one would grow past what Mailtrap accepts once encoded.
+def _json_list_attachments(rows, filename_stem):
+    max_size = DELETION_REPORT_ATTACHMENT_SIZE
+    contents = []
+    encoder, size = None, 0
+    for row in rows:
+        line = "  " + json.dumps(row, sort_keys=True, cls=JsonEncoder)
+        line_size = len(line.encode())
+        if encoder and size + len(",\n") + line_size + len("\n]") > max_size:
+            encoder.write("\n]")
+            contents.append(encoder.getvalue())
+            encoder = None
+
+        if encoder:
+            encoder.write(",\n")
+            size += len(",\n")
+        else:
+            encoder = render.Base64Writer(MAILTRAP_EMAIL_SIZE_LIMIT)
+            encoder.write("[\n")
+            size = len("[\n")
+
+        encoder.write(line)
+        size += line_size
+
+    if encoder:
+        encoder.write("\n]")
+        contents.append(encoder.getvalue())
+
+    if len(contents) == 1:
+        return [Attachment(content=contents[0], filename=f"{filename_stem}.json")]
+    return [Attachment(content=content, filename=f"{filename_stem}-{idx}.json") for idx, content in enumerate(contents, start=1)]
+
+def _iter_true_deletions(deleted_showtimes):
+    for theater, theater_deleted_showtimes in group_dict_by(deleted_showtimes, "theater").items():
+        candidate_hashes = {diff.stored_hash(s, "start_hash") for s in theater_deleted_showtimes if diff.may_be_runtime_update(s)}
+        current_start_hashes = db.find_showtime_start_hashes(theater, candidate_hashes)
+        for showtime in diff.true_deletions(theater_deleted_showtimes, current_start_hashes):
+            yield _report_row(showtime)
+
+@task
+def send_deletion_report():
+    last_time = datetime.now()
+    first_time = db.last_successful_task_run(db.Task.DELETION_REPORT) or (last_time - timedelta(days=365))
 
-    for idx, showtimes_chunk in enumerate(chunks, start=1):
-        deleted_showtimes_json = "[\n" + ",\n".join([f"  {json.dumps(s, sort_keys=True)}" for s in showtimes_chunk]) + "\n]"
-        filename = f"deleted-{idx}.json" if len(chunks) > 1 else "deleted.json"
-        deleted_attachment = _build_attachment(deleted_showtimes_json, filename)
+    deleted_showtimes = db.load_deleted_showtimes_by_delete_time(first_time, last_time, order_by="theater, title", clean=False)
+    attachments = _json_list_attachments(_iter_true_deletions(deleted_showtimes), "deleted")
 
-        subject = f"Schedule Updater Deletion Report ({date_range_to_str([first_time, last_time])})"
-        msg = "Deletion report attached" + (f" ({idx} / {len(chunks)})" if len(chunks) > 1 else "")
-        _send_email(subject, msg,  attachments=[deleted_attachment])
+    subject = f"Schedule Updater Deletion Report ({date_range_to_str([first_time, last_time])})"
+    for idx, attachment in enumerate(attachments, start=1):
+        msg = "Deletion report attached" + (f" ({idx} / {len(attachments)})" if len(attachments) > 1 else "")
+        _send_email(subject, msg, attachments=[attachment])
 
 
 def send_error_email(exc):
@@ -215,41 +346,84 @@ def add_theater(name, *, tzname, parser, is_open=True, rank=None, fullname=None)
     db.add_theater(name=name, fullname=fullname, tzname=tzname, is_open=is_open, rank=rank, parser=parser, code=None, query=None)
 
 
-def add_theater_from_search(query, *, name=None, rank=None):
-    name = name or query
-    search_result = fandango_json.search(query)
+async def _search_theater_async(query, fetcher):
+    search_result = await fandango_json.search_async(query, fetcher=fetcher)
     if len(search_result) == 1:
-        result = search_result[0]
-        tzname = fandango_json.get_tzname(result["code"])
-        db.add_theater(**result, name=name, rank=rank, tzname=tzname)
-    elif len(search_result) < 1:
-        print(f"[ERROR] No results found for \"{query}\".") 
-    else:
-        print(f"[ERROR] Found mutiple theaters for \"{query}\". Please narrow the search term.")
-        for result in search_result:
-            print(f"- {result['fullname']}")
+        search_result[0]["tzname"] = await fandango_json.get_tzname_async(search_result[0]["code"], fetcher=fetcher)
+    return search_result
+
+
+async def _search_theaters_async(queries):
+    async with AsyncFetcher(get_scan_concurrency()) as fetcher:
+        return await asyncio.gather(*[_search_theater_async(query, fetcher) for query in queries], return_exceptions=True)
+
+
+def add_theaters_from_search(searches):
+    """Adds many Fandango theaters at once.
+
+    Each search is a dict with a "query", and optionally the "name" and
+    "rank" to add its theater with. The searches (and the time zone lookups
+    for the theaters they find) all run concurrently, and are then added in
+    the order given.
+    """
+    search_results = asyncio.run(_search_theaters_async([search["query"] for search in searches]))
+    for search, search_result in zip(searches, search_results):
+        query = search["query"]
+        if isinstance(search_result, Exception):
+            print(f"[ERROR] Search for \"{query}\" failed: {search_result}")
+        elif len(search_result) == 1:
+            db.add_theater(**search_result[0], name=search.get("name") or query, rank=search.get("rank"))
+        elif len(search_result) < 1:
+            print(f"[ERROR] No results found for \"{query}\".")
+        else:
+            print(f"[ERROR] Found mutiple theaters for \"{query}\". Please narrow the search term.")
+            for result in search_result:
+                print(f"- {result['fullname']}")
 
 
-def _gather_fandango_screens(showtimes):
-    hash_to_auditorium = fandango_json.gather_seat_info(showtimes)
-    db.update_screens(hash_to_auditorium)
+def add_theater_from_search(query, *, name=None, rank=None):
+    add_theaters_from_search([{"query": query, "name": name, "rank": rank}])
+
 
+def _gather_fandango_screens(showtimes, deadline=None):
+    now = datetime.now(timezone.utc)
+    showtimes = [showtime for showtime in showtimes if fandango_json.needs_screen_lookup(showtime)]
 
-def gather_fandango_screens_new_showtimes(first_create_time):
+    cached = db.load_fandango_screens({showtime["extra_properties"]["hash"] for showtime in showtimes})
+    to_fetch = [showtime for showtime in showtimes if showtime["extra_properties"]["hash"] not in cached]
+    fetched = fandango_json.gather_seat_info(to_fetch, deadline)
+    db.store_fandango_screens(fetched, now)
+
+    print(f"Fandango screens: {len(showtimes)} showtime(s) without a screen, {len(cached)} cached, {len(fetched)} of {len(to_fetch)} fetched")
+    db.update_screens(cached | fetched)
+
+
+def gather_fandango_screens_new_showtimes(first_create_time, deadline=None):
     last_create_time = datetime.now(timezone.utc)
 
     showtimes = db.load_showtimes_by_create_time(first_create_time, last_create_time)
-    _gather_fandango_screens(showtimes)
+    _gather_fandango_screens(showtimes, deadline)
 
 
-@task
-def gather_fandango_screens_by_theater(theater):
+def _fandango_theaters():
+    return [theater["name"] for theater in db.get_theaters(clean=False) if theater["parser"] == "fandango_json"]
+
+
+def _load_upcoming_showtimes(theaters):
     first_time = datetime.now().replace(microsecond=0)
     last_time = first_time + timedelta(days=get_days_to_scan())
+    return [showtime for theater in theaters for showtime in db.load_showtimes(first_time, last_time, theater)]
 
-    fandango_theaters = [theater["name"] for theater in db.get_theaters(clean=False) if theater["parser"] == "fandango_json"]
+
+@task
+def gather_fandango_screens_by_theater(theater):
+    fandango_theaters = _fandango_theaters()
     if theater not in fandango_theaters:
-        raise ValueError(f"{theater} is not one of: {fandango_theaters.join(', ')}.")
+        raise ValueError(f"{theater} is not one of: {', '.join(fandango_theaters)}.")
+
+    _gather_fandango_screens(_load_upcoming_showtimes([theater]))
 
-    showtimes = db.load_showtimes(first_time, last_time, theater)
-    _gather_fandango_screens(showtimes)
+
+@task
+def gather_fandango_screens():
+    _gather_fandango_screens(_load_upcoming_showtimes(_fandango_theaters()))
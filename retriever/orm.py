@@ -6,7 +6,7 @@ from collections.abc import KeysView, ValuesView
 from datetime import date, datetime, time, timezone
 
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_batch
 
 from retriever.utils import flatten
 
@@ -22,12 +22,16 @@ def init():
         _DATETIME = ""
 
 
+def using_postgres():
+    return bool(os.getenv('DATABASE_URL'))
+
+
 def _cast_value(value):
     if isinstance(value, bool):
         return int(value)
     elif isinstance(value, (list, dict)):
         return json.dumps(value)
-    elif isinstance(value, set):
+    elif isinstance(value, (set, frozenset)):
         return json.dumps(sorted(value))
     elif isinstance(value, (datetime, date, time)):
         return value.isoformat()
@@ -176,6 +180,13 @@ class connection():
         return [dict(row) for row in cur.fetchall()]
     
 
+    # For queries the builders here can't express, such as joins. Each
+    # parameter's place in the query is marked with {ph}.
+    def query(self, query, params=()):
+        cur = self._execute(query.format(ph=_PH), params)
+        return [dict(row) for row in cur.fetchall()]
+
+
     def selectone(self, table, columns=None, where=None, *, group_by=None, order_by=None):
         results = self.select(table, columns, where, group_by=group_by, order_by=order_by)
         return results[0] if results else {}
@@ -197,6 +208,24 @@ class connection():
         
         self._execute(query_parts, tuple(assign.values()) + where_params)
 
+    # Updates many rows in one batch, each matched on its key columns. Every
+    # row must have the same columns.
+    def update_many(self, table, rows, key_columns):
+        if not rows:
+            return
+
+        assign_columns = [col for col in rows[0] if col not in key_columns]
+        assignment_statements = ", ".join([f"{col} = {_PH}" for col in assign_columns])
+        key_constraint = " AND ".join([f"{col} = {_PH}" for col in key_columns])
+        query = f"UPDATE {table} SET {assignment_statements} WHERE {key_constraint}"
+        params = [[_cast_value(row[col]) for col in [*assign_columns, *key_columns]] for row in rows]
+
+        cur = self.db.cursor()
+        if using_postgres():
+            execute_batch(cur, query, params)
+        else:
+            cur.executemany(query, params)
+
     def insert(self, table, assignments, *, conflict=None):
         if not assignments:
             raise ValueError("Request to insert was empty.")
@@ -213,9 +242,40 @@ class connection():
 
     def delete(self, table, where):
         where_constraint, where_params = _build_where_constraint(where)
-        
+
         query_parts = [f"DELETE FROM {table}", f"WHERE {where_constraint}"]
         self._execute(query_parts, where_params)
 
 
+    # CREATE TABLE IF NOT EXISTS leaves existing tables alone, so columns
+    # added after a table was first created go through here.
+    def add_column(self, table, column, definition):
+        if using_postgres():
+            self._execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}", ())
+            return
+
+        existing_columns = {row["name"] for row in self._execute(f"PRAGMA table_info({table})", ()).fetchall()}
+        if column not in existing_columns:
+            self._execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}", ())
+
+
+    # Postgres only. The extension may not be installed on the server, or the
+    # user may lack the rights to create it; either way this returns False,
+    # and the transaction carries on as if it had never been tried.
+    def create_extension(self, name):
+        if not using_postgres():
+            return False
+
+        cur = self.db.cursor()
+        cur.execute(f"SAVEPOINT create_{name}")
+        try:
+            cur.execute(f"CREATE EXTENSION IF NOT EXISTS {name}")
+        except psycopg2.Error:
+            cur.execute(f"ROLLBACK TO SAVEPOINT create_{name}")
+            return False
+
+        cur.execute(f"RELEASE SAVEPOINT create_{name}")
+        return True
+
+
 init()
@@ -0,0 +1,95 @@
+import asyncio
+import atexit
+import concurrent.futures
+import multiprocessing
+import threading
+
+from retriever.utils import get_parse_workers
+
+_executor = None
+_executor_lock = threading.Lock()
+_inline = False
+
+
+# Workers are never forked straight from this process: it may be a threaded
+# server, and a fork taken while another thread holds a lock (logging, the DB
+# driver, the fetch caches) leaves that lock held forever in the child. They're
+# forked from a clean fork server instead, or spawned where there isn't one.
+def _mp_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+# The pool is created on first use and shared by every parser for the life of
+# the process. Some hosts (e.g. serverless runtimes without /dev/shm) can't
+# create one at all, in which case parsing just runs inline.
+def _get_executor():
+    global _executor, _inline
+    with _executor_lock:
+        if _executor is None and not _inline:
+            workers = get_parse_workers()
+            if workers > 1:
+                try:
+                    _executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context())
+                except (OSError, NotImplementedError) as exc:
+                    print(f"[WARN] Unable to start the parse pool, so parsing will run inline: {exc}")
+
+            _inline = _executor is None
+        return _executor
+
+
+def _run_inline(func, *args):
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def _mark_broken(exc):
+    global _executor, _inline
+    print(f"[WARN] The parse pool broke, so parsing will run inline from now on: {exc}")
+    with _executor_lock:
+        _executor = None
+        _inline = True
+
+
+# Parse functions must be module-level, and both their arguments and results
+# picklable (e.g. raw page text in, ShowingRecords out).
+def submit(func, *args):
+    executor = _get_executor()
+    if executor:
+        try:
+            return executor.submit(func, *args)
+        except concurrent.futures.process.BrokenProcessPool as exc:
+            _mark_broken(exc)
+    return _run_inline(func, *args)
+
+
+def run(func, *args):
+    try:
+        return submit(func, *args).result()
+    except concurrent.futures.process.BrokenProcessPool as exc:
+        _mark_broken(exc)
+        return func(*args)
+
+
+async def run_async(func, *args):
+    try:
+        return await asyncio.wrap_future(submit(func, *args))
+    except concurrent.futures.process.BrokenProcessPool as exc:
+        _mark_broken(exc)
+        return func(*args)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor:
+            _executor.shutdown()
+            _executor = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,114 @@
+import contextvars
+import importlib
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date
+from functools import cache
+
+# What the scanner needs to know about a parser, without importing it.
+# - whole_feed: it downloads everything the theater lists in one go,
+#     regardless of the date range asked for.
+# - supports_async: it has load_schedules_by_day_async.
+# - needs_browser: it renders pages with Playwright.
+# - streams: it has iter_schedules_by_day, which yields each day as soon as
+#     it's been read.
+ParserInfo = namedtuple("ParserInfo", ["name", "whole_feed", "supports_async", "needs_browser", "streams"])
+
+# fandango_html is left out until it can be imported again.
+PARSERS = {info.name: info for info in (
+    ParserInfo("brattle", whole_feed=True, supports_async=False, needs_browser=False, streams=False),
+    ParserInfo("coolidge", whole_feed=False, supports_async=True, needs_browser=False, streams=False),
+    ParserInfo("fandango_json", whole_feed=False, supports_async=True, needs_browser=False, streams=True),
+    ParserInfo("red_river", whole_feed=True, supports_async=False, needs_browser=False, streams=False),
+    ParserInfo("somerville_theater", whole_feed=True, supports_async=False, needs_browser=False, streams=False)
+)}
+
+# The range a whole feed is loaded over when it's cached, so it can answer
+# any range asked of it later.
+FULL_FEED_RANGE = (date.min, date.max)
+
+
+# The whole feeds loaded so far in one scan run, keyed by theater.
+class _FeedCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def load(self, parser, theater_info, quiet):
+        with self._lock:
+            entry = self._entries.setdefault(theater_info["name"], {"lock": threading.Lock(), "schedules": None})
+
+        # Held separately from the cache's lock, so loading one theater's feed
+        # doesn't hold up another's.
+        with entry["lock"]:
+            if entry["schedules"] is None:
+                entry["schedules"] = parser.load_schedules_by_day(theater_info, FULL_FEED_RANGE, quiet)
+        return entry["schedules"]
+
+
+# Scans for separate requests can run at once on the server's threads, so
+# each run's cache is only visible within its own context. Threads and tasks
+# started from within a run (asyncio.to_thread, asyncio.run) copy the
+# context, and so share the run's cache.
+_feed_cache = contextvars.ContextVar("feed_cache", default=None)
+
+
+def get_parser_info(name):
+    try:
+        return PARSERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown parser: {name}.")
+
+@cache
+def get_parser(name):
+    info = get_parser_info(name)
+    try:
+        return importlib.import_module(f"{__name__}.{info.name}")
+    except ImportError as exc:
+        raise ValueError(f"Parser {info.name} could not be loaded: {exc}") from exc
+
+
+@contextmanager
+def scan_run():
+    """Shares the whole-feed parsers' feeds for the duration of a scan.
+
+    Within a scan run, each whole-feed theater is loaded at most once, no
+    matter how many date ranges are asked of it. Nested runs share the
+    outermost run's feeds.
+    """
+    if _feed_cache.get() is not None:
+        yield
+        return
+
+    token = _feed_cache.set(_FeedCache())
+    try:
+        yield
+    finally:
+        _feed_cache.reset(token)
+
+
+def load_schedules_by_day(theater_info, date_range, quiet=False):
+    info = get_parser_info(theater_info["parser"])
+    parser = get_parser(info.name)
+    feed_cache = _feed_cache.get()
+    if not info.whole_feed or feed_cache is None:
+        return parser.load_schedules_by_day(theater_info, date_range, quiet)
+
+    schedules = feed_cache.load(parser, theater_info, quiet)
+    return [schedule for schedule in schedules if date_range[0] <= schedule.day <= date_range[1]]
+
+def iter_schedules_by_day(theater_info, date_range, quiet=False):
+    info = get_parser_info(theater_info["parser"])
+    if info.streams:
+        yield from get_parser(info.name).iter_schedules_by_day(theater_info, date_range, quiet)
+    else:
+        yield from load_schedules_by_day(theater_info, date_range, quiet)
+
+async def load_schedules_by_day_async(theater_info, date_range, quiet=False, *, fetcher):
+    info = get_parser_info(theater_info["parser"])
+    if info.supports_async:
+        return await get_parser(info.name).load_schedules_by_day_async(theater_info, date_range, quiet, fetcher=fetcher)
+
+    # Parsers that haven't moved to the async protocol are run on a thread.
+    return await fetcher.run_sync(load_schedules_by_day, theater_info, date_range, quiet)
@@ -1,16 +1,15 @@
 from datetime import date, datetime, timedelta
 
-import requests
-from bs4 import BeautifulSoup
-
-from retriever.schedule import DaySchedule, FullSchedule
+from retriever import fetch, parse_pool
+from retriever.parsers import markup
+from retriever.schedule import DaySchedule, FullSchedule, schedules_from_records, schedules_to_records
 
 THEATER_NAME = "Brattle Theater"
 SHOWTIMES_URL = "https://brattlefilm.org/coming-soon/"
 SHOWTIMES_HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36'}
 
 def _retrieve_page():
-    return requests.get(SHOWTIMES_URL, headers=SHOWTIMES_HEADERS).text
+    return fetch.get(SHOWTIMES_URL, headers=SHOWTIMES_HEADERS).text
 
 def _parse_language(movie_info):
     language_el = movie_info.find(class_="show-spec-label", string="Language:")
@@ -47,6 +46,8 @@ def _load_schedules(page, tzname):
         if not showtimes_section:
             continue
 
+        runtime_str = movie_info.find(class_="show-spec-label", string="Run Time:").next_sibling.strip()
+
         raw_programs = {el.get_text(strip=True) for el in movie_info.find(class_="pill-container").find_all(class_="pill")}
         programs = {prog for prog in raw_programs if prog not in ("35mm Screenings", "Closed Captions")}
         
@@ -62,10 +63,7 @@ def _load_schedules(page, tzname):
             showdate = datetime.fromtimestamp(int(screening_info["data-date"])).date()
             schedule = schedules[showdate] = schedules.get(showdate, DaySchedule(THEATER_NAME, showdate))
             
-            movie = next((m for m in schedule.movies if m.name == name), None)
-            if not movie:
-                runtime_str = movie_info.find(class_="show-spec-label", string="Run Time:").next_sibling.strip()
-                movie = schedule.add_raw_movie(name, runtime_str)
+            movie = schedule.get_or_add_raw_movie(name, runtime_str)
             
             fmt = _parse_format(movie_info)
             language = _parse_language(movie_info)
@@ -75,8 +73,11 @@ def _load_schedules(page, tzname):
 
     return sorted(schedules.values(), key=lambda s: s.day)
 
+def _parse_page(showtimes_text, tzname):
+    showtimes_html = markup.parse_html(showtimes_text, markup.by_class("show-details"))
+    return schedules_to_records(_load_schedules(showtimes_html, tzname))
+
 def load_schedules_by_day(theater_info, date_range, quiet=False):
-    schedules_by_day = []
-    showtimes_html = BeautifulSoup(_retrieve_page(), 'html.parser')
-    schedules_by_day = _load_schedules(showtimes_html, theater_info["tzname"])
+    records = parse_pool.run(_parse_page, _retrieve_page(), theater_info["tzname"])
+    schedules_by_day = schedules_from_records(THEATER_NAME, records)
     return [s for s in schedules_by_day if date_range[0] <= s.day <= date_range[1]]
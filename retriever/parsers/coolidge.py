@@ -1,12 +1,13 @@
+import asyncio
 import re
 from calendar import day_abbr
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from urllib.parse import urlsplit, parse_qs
 
-import requests
-from bs4 import BeautifulSoup
-
-from retriever.schedule import DaySchedule, FullSchedule, Showing
+from retriever import parse_pool
+from retriever.fetch import AsyncFetcher
+from retriever.parsers import markup
+from retriever.schedule import DaySchedule, FullSchedule, parse_clock_time
 
 
 THEATER_NAME = "Coolidge Corner"
@@ -15,7 +16,10 @@ SIGNATURE_PROGRAMS_URL = COOLIDGE_URL
 SHOWTIMES_URL_FMT = f"{COOLIDGE_URL}showtimes?date={{date}}"
 OPEN_CAPTIONS_URL = f"{COOLIDGE_URL}films-events/open-captions"
 
-projection_specifics_cache = {}
+PROJECTION_SPECIFICS_TTL = timedelta(hours=12)
+
+# The most requests to have in flight to Coolidge's site at once.
+MAX_CONCURRENCY = 6
 
 WEEKDAY_REGEX = "Mon|Tue|Wed|Thu|Fri|Sat|Sun"
 RANGE_RE = re.compile(rf"(?:\d\d?(?::\d\d)?(?:am|pm)).*?(?:{WEEKDAY_REGEX})(?:-(?:{WEEKDAY_REGEX}))?")
@@ -25,20 +29,33 @@ DAYS_RE = re.compile(rf"({WEEKDAY_REGEX})")
 
 # TODO: Read each movie's details page to grab its language.
 
-def _retrieve_page(url):
-    return BeautifulSoup(requests.get(url).text, 'html.parser')
+async def _retrieve_text(fetcher, semaphore, url):
+    async with semaphore:
+        return await fetcher.get_text(url)
+
+async def _retrieve_movie_detail_text(fetcher, semaphore, movie_detail_path):
+    return await _retrieve_text(fetcher, semaphore, f"{COOLIDGE_URL}{movie_detail_path}")
 
-def _retrieve_movie_detail_page(movie_detail_path):
-    return _retrieve_page(f"{COOLIDGE_URL}{movie_detail_path}")
+async def _retrieve_showtimes_text(fetcher, semaphore, showdate):
+    return await _retrieve_text(fetcher, semaphore, SHOWTIMES_URL_FMT.format(date=showdate))
 
-def _retrieve_showtimes_page(showdate):
-    return _retrieve_page(SHOWTIMES_URL_FMT.format(date=showdate))
+async def _retrieve_open_captions_text(fetcher, semaphore):
+    return await _retrieve_text(fetcher, semaphore, OPEN_CAPTIONS_URL)
 
-def _retrieve_open_captions_page():
-    return _retrieve_page(OPEN_CAPTIONS_URL)
+async def _retrieve_signature_programs_text(fetcher, semaphore):
+    return await _retrieve_text(fetcher, semaphore, SIGNATURE_PROGRAMS_URL)
 
-def _retrieve_signature_programs_page():
-    return _retrieve_page(SIGNATURE_PROGRAMS_URL)
+# Fetches the side pages and every day's page all at once. The day pages are
+# returned in date order, alongside their dates.
+async def _retrieve_pages(fetcher, date_range):
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    showdates = list(_showdates_iter(date_range))
+    signature_programs_text, open_captions_text, *showtimes_texts = await asyncio.gather(
+        _retrieve_signature_programs_text(fetcher, semaphore),
+        _retrieve_open_captions_text(fetcher, semaphore),
+        *[_retrieve_showtimes_text(fetcher, semaphore, showdate) for showdate in showdates]
+    )
+    return signature_programs_text, open_captions_text, list(zip(showtimes_texts, showdates))
 
 def _dict_find_by_value(adict, target_value):
     for key, value in adict.items():
@@ -46,9 +63,8 @@ def _dict_find_by_value(adict, target_value):
             return key
     return None
 
-def _apply_projection_specifics(name, raw_showtime, day, tzname, attributes):
-    showtime = Showing._parse_showtime(raw_showtime, tzname)
-    projection_specifics = projection_specifics_cache.get(name)
+def _apply_projection_specifics(projection_specifics, raw_showtime, day, attributes):
+    showtime = parse_clock_time(raw_showtime)
     if projection_specifics:
         fmt = projection_specifics["format"]
         dates_to_times = projection_specifics.get("showtimes")
@@ -67,10 +83,13 @@ def _apply_projection_specifics(name, raw_showtime, day, tzname, attributes):
 
 # New example to try out:
 # Screening in 35mm in Moviehouse 2 (MH2) at 7:00pm/6:45pm and 9:30pm Friday through Sunday, April 17 - 19. Screening digitally in all other houses and on Mon-Wed.
-def _load_projection_specifics(movie_detail_path, fmt, tzname):
+def _load_projection_specifics(detail_text, fmt):
     day_to_times = None
     try:
-        detail_page = _retrieve_movie_detail_page(movie_detail_path)
+        if isinstance(detail_text, Exception):
+            raise detail_text
+
+        detail_page = markup.parse_html(detail_text, markup.by_class("cite", "datepicker__date"))
         notes_block_el = detail_page.find(class_="cite")
         if notes_block_el:
             line = notes_block_el.get_text(strip=True).split(".", 1)[0]
@@ -92,7 +111,7 @@ def _load_projection_specifics(movie_detail_path, fmt, tzname):
 
                 day = end_date
                 while True:
-                    day_to_times[day] = [Showing._parse_showtime(time_str, tzname) for time_str in time_matches]
+                    day_to_times[day] = [parse_clock_time(time_str) for time_str in time_matches]
                     if day.weekday() == list(day_abbr).index(day_matches[0]):
                         break
 
@@ -106,12 +125,29 @@ def _load_projection_specifics(movie_detail_path, fmt, tzname):
         "showtimes": day_to_times
     }
 
-def _update_projection_specifics_cache(attributes, movie_info, name, tzname):
-    if "35mm" in attributes:
-        attributes.remove("35mm")
-        if name not in projection_specifics_cache:
-            movie_detail_path = movie_info.find(class_="film-card__link")["href"]
-            projection_specifics_cache[name] = _load_projection_specifics(movie_detail_path, "35mm", tzname)
+# Fetches the projection specifics of every 35mm film in the scan before its
+# schedules are built. They're cached in the DB by detail page, so most scans
+# only need to fetch the films that are new since the last one.
+#
+# The DB is imported here rather than at the top since the parse pool's workers
+# import this module for its parse functions, and they shouldn't each open it.
+async def _prefetch_projection_specifics(movie_detail_paths, fetcher):
+    from retriever import db
+
+    now = datetime.now(timezone.utc)
+    cached = db.load_projection_specifics(movie_detail_paths, now - PROJECTION_SPECIFICS_TTL)
+    missing = [path for path in movie_detail_paths if path not in cached]
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    detail_texts = await asyncio.gather(*[_retrieve_movie_detail_text(fetcher, semaphore, path) for path in missing], return_exceptions=True)
+    fetched = {path: _load_projection_specifics(detail_text, "35mm") for path, detail_text in zip(missing, detail_texts)}
+
+    print(f"Coolidge projection specifics: {len(cached)} cache hit(s), {len(missing)} miss(es)")
+
+    # Failed loads (marked with an asterisk) aren't cached, so they're retried
+    # on the next scan.
+    db.store_projection_specifics({path: specifics for path, specifics in fetched.items() if not specifics["format"].endswith("*")}, now)
+    return cached | fetched
 
 # Makes Coolidge's tagging work better for me by recatagorizing some.
 def _program_adjustments(attributes, programs):
@@ -154,8 +190,12 @@ def _parse_format(raw_attributes):
     else:
         return None
 
-def _load_schedule(page, day, tzname, open_captions_dict, signature_programs_dict):
-    schedule = DaySchedule(THEATER_NAME, day)
+# Pulls what's needed out of each film card, without yet building the
+# schedule. This runs in the parse pool, and the 35mm films' projection
+# specifics have to be loaded before their showings can be formatted.
+def _parse_film_cards(showtimes_text, signature_programs_dict):
+    page = markup.parse_html(showtimes_text, markup.by_class("film-card"))
+    film_cards = []
     for movie_info in page.find_all(class_="film-card"):
         part_of_package_el = movie_info.find(class_="view-part-of-package-title")
         if part_of_package_el.get_text(strip=True):
@@ -169,8 +209,6 @@ def _load_schedule(page, day, tzname, open_captions_dict, signature_programs_dic
         raw_runtime_str = runtime_el.get_text(strip=True) if runtime_el else "0mins"
         runtime_str = ' '.join([s.strip() for s in raw_runtime_str.splitlines()])
 
-        movie = schedule.add_raw_movie(name, runtime_str)
-
         attrib_chip_parent = movie_info.find(class_="view-film-event-type-link")
         attributes = [a.get_text(strip=True) for a in attrib_chip_parent.find_all(class_="film-program__title")] if attrib_chip_parent else []
 
@@ -183,23 +221,48 @@ def _load_schedule(page, day, tzname, open_captions_dict, signature_programs_dic
                 raw_programs.append(signature_programs_dict.get(path, chip_label))
 
         _program_adjustments(attributes, raw_programs)
-        _update_projection_specifics_cache(attributes, movie_info, name, tzname)
-        if not attributes:
-            attributes.append("Standard")
 
+        movie_detail_path = None
+        if "35mm" in attributes:
+            attributes.remove("35mm")
+            movie_detail_path = movie_info.find(class_="film-card__link")["href"]
+
+        showings = []
         for showing_el in movie_info.find_all(class_="showtime-ticket__button"):
-            programs = raw_programs.copy()
             qs_dict = parse_qs(urlsplit(showing_el["href"]).query)
             id_ = (qs_dict.get("evtinfo") or qs_dict["guid"])[0]
-
-            showing_info_el = showing_el.find_all(class_="showtime-ticket")
             raw_showtime = showing_el.find(class_="showtime-ticket__time").get_text(strip=True)
+            screen = showing_el.find(class_="showtime-ticket__venue").get_text(strip=True)
+            showings.append((id_, raw_showtime, screen))
+
+        film_cards.append({
+            "name": name,
+            "runtime": runtime_str,
+            "attributes": attributes,
+            "programs": raw_programs,
+            "movie_detail_path": movie_detail_path,
+            "showings": showings
+        })
+
+    return film_cards
+
+def _load_schedule(film_cards, day, tzname, open_captions_dict, projection_specifics_by_path):
+    schedule = DaySchedule(THEATER_NAME, day)
+    for film_card in film_cards:
+        name = film_card["name"]
+        movie = schedule.add_raw_movie(name, film_card["runtime"])
+
+        attributes = film_card["attributes"].copy()
+        projection_specifics = projection_specifics_by_path.get(film_card["movie_detail_path"])
+        if not attributes:
+            attributes.append("Standard")
+
+        for id_, raw_showtime, screen in film_card["showings"]:
+            programs = film_card["programs"].copy()
             if raw_showtime in open_captions_dict.get(name, {}).get(day, []):
                 programs.append("Open Caption")
 
-            screen = showing_el.find(class_="showtime-ticket__venue").get_text(strip=True)
-            
-            _apply_projection_specifics(name, raw_showtime, day, tzname, attributes)
+            _apply_projection_specifics(projection_specifics, raw_showtime, day, attributes)
 
             fmt = _parse_format(attributes)
             language = None
@@ -208,22 +271,21 @@ def _load_schedule(page, day, tzname, open_captions_dict, signature_programs_dic
 
     return schedule
 
-def _showtimes_text_iter(date_range):
+def _showdates_iter(date_range):
     current_date, end_date = date_range
     
     while current_date <= end_date:
-        page = _retrieve_showtimes_page(current_date)
-        yield (page, current_date)
+        yield current_date
         current_date += timedelta(days=1)
 
-def _load_signature_programs():
-    page = _retrieve_signature_programs_page()
+def _load_signature_programs(page_text):
+    page = markup.parse_html(page_text, markup.by_class("menu-item"))
     signature_programs_menu_el = page.find(lambda el: "menu-item" in el.get("class", []) and el.find(string="Signature Programs"))
     return {item.a["href"].replace("/programs", ""): item.get_text(strip=True) for item in signature_programs_menu_el.find_all(class_="menu-item")}
 
-def _load_open_captions_showtimes():
+def _load_open_captions_showtimes(page_text):
     open_captions = {}
-    page = _retrieve_open_captions_page()
+    page = markup.parse_html(page_text, markup.by_class("showtimes"))
     for movie_info in page.find_all(class_="showtimes"):
         name = movie_info.find(class_="film-card__title").get_text(strip=True)
         open_captions[name] = {}
@@ -238,17 +300,30 @@ def _load_open_captions_showtimes():
     return open_captions
 
 
-def load_schedules_by_day(theater_info, date_range, quiet=False):
-    schedules_by_day = []
+async def load_schedules_by_day_async(theater_info, date_range, quiet=False, *, fetcher):
     if not quiet:
         print(".", end="", flush=True)
 
-    signature_programs_dict = _load_signature_programs()
-    open_captions_dict = _load_open_captions_showtimes()
-    for showtimes_html, day in _showtimes_text_iter(date_range):
-        schedules_by_day.append(_load_schedule(showtimes_html, day, theater_info["tzname"], open_captions_dict, signature_programs_dict))
+    tzname = theater_info["tzname"]
+    signature_programs_text, open_captions_text, showtimes_texts = await _retrieve_pages(fetcher, date_range)
+
+    signature_programs_dict, open_captions_dict = await asyncio.gather(
+        parse_pool.run_async(_load_signature_programs, signature_programs_text),
+        parse_pool.run_async(_load_open_captions_showtimes, open_captions_text)
+    )
+    all_film_cards = await asyncio.gather(*[parse_pool.run_async(_parse_film_cards, showtimes_text, signature_programs_dict) for showtimes_text, _ in showtimes_texts])
+
+    if not quiet:
+        print("." * len(showtimes_texts), end="", flush=True)
+
+    movie_detail_paths = {card["movie_detail_path"] for film_cards in all_film_cards for card in film_cards if card["movie_detail_path"]}
+    projection_specifics_by_path = await _prefetch_projection_specifics(movie_detail_paths, fetcher)
 
-        if not quiet:
-            print(".", end="", flush=True)
+    return [_load_schedule(film_cards, day, tzname, open_captions_dict, projection_specifics_by_path) for film_cards, (_, day) in zip(all_film_cards, showtimes_texts)]
 
-    return schedules_by_day
+async def _load_schedules_by_day(theater_info, date_range, quiet):
+    async with AsyncFetcher(MAX_CONCURRENCY) as fetcher:
+        return await load_schedules_by_day_async(theater_info, date_range, quiet, fetcher=fetcher)
+
+def load_schedules_by_day(theater_info, date_range, quiet=False):
+    return asyncio.run(_load_schedules_by_day(theater_info, date_range, quiet))
@@ -1,9 +1,9 @@
 import calendar
 import re
-from bs4 import BeautifulSoup
 from datetime import date, timedelta
 from playwright.sync_api import sync_playwright
 
+from retriever.parsers import markup
 from retriever.schedule import DaySchedule, THEATER_SLUG_DICT
 
 
@@ -71,7 +71,7 @@ def load_schedules_by_day(theater, filepath, showdate, date_range, filter_params
     schedules_by_day = []
     print(".", end="", flush=True)
     for showtimes_text in _showtimes_text_iter(theater, filepath, showdate, date_range):
-        page = BeautifulSoup(showtimes_text, 'html.parser')
+        page = markup.parse_html(showtimes_text)
         schedule = _load_schedule(page)
         filtered_schedule = schedule.filter(filter_params)
         schedules_by_day.append(filtered_schedule)
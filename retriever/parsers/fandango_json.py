@@ -1,14 +1,32 @@
+import asyncio
 import calendar
 import concurrent.futures
 import itertools
 import json
-import os
-import requests
 import time
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
 from urllib.parse import urlencode
 
+from retriever import db, fetch
 from retriever.schedule import DaySchedule
+from retriever.utils import get_scan_budget, tzname_at
+
+FANDANGO_HEADERS = {"referer": "https://www.fandango.com"}
+
+# Showtimes of these types aren't on sale, so there's no seat map to read
+# their screen from.
+UNSELLABLE_SHOWTIME_TYPES = ("restricted", "soldout")
+
+MIN_SEAT_WORKERS = 2
+INITIAL_SEAT_WORKERS = 8
+MAX_SEAT_WORKERS = 16
+MAX_SEAT_ERROR_RATE = 0.1
+# Past these, the seat maps still pending are left for the next run, which
+# picks them up again since their screens are still missing.
+MAX_RATE_LIMITED_ROUNDS = 5
+MAX_RATE_LIMIT_WAIT = timedelta(seconds=30)
+# In seconds, for a seat map requested just before the deadline.
+MIN_SEAT_REQUEST_TIMEOUT = 1
 
 SEAT_INFO_ERROR_CODES = (
     "ExpiredPerformance",  # shouldn't happen.
@@ -18,6 +36,12 @@ SEAT_INFO_ERROR_CODES = (
     "GeneralAdmissionShowtimeError"  # something about an event that's General Admission?
 )
 
+class RateLimitedError(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__(f"Rate limited by Fandango (Retry-After: {retry_after})")
+        self.retry_after = retry_after
+
+
 def _parse_language(attributes, theater):
     for attr in attributes:
         if "dubbed" in attr or "subtitles" in attr or "language" in attr:
@@ -90,10 +114,8 @@ def _load_schedule(showtimes_json, theater_info):
                 fmt = "Dolby"
                 language = None
 
-            # TODO: If the showtime is not on sale, its hash should be omitted, so we don't try to get its screen. But
-            # I need to investigate the possible values of the showtime "type" field. I think "restricted" means
-            # they're not for sale, and "soldout" means they're sold out. "available" should mean they're on sale, and
-            # thus querying for the screen is useful.
+            # The showtime "type" is kept so screens are only looked up for showtimes on sale. See
+            # UNSELLABLE_SHOWTIME_TYPES.
             for showtime in showtimes_listing["showtimes"]:
                 id_ = showtime.get("id")
                 hash_ = showtime["showtimeHashCode"]
@@ -103,66 +125,93 @@ def _load_schedule(showtimes_json, theater_info):
     return schedule
 
 
-def _request(url, headers=None):
-    return requests.get(url, headers=headers)
+def _request(url, headers=None, timeout=fetch.REQUEST_TIMEOUT):
+    return fetch.get(url, headers=headers, timeout=timeout)
 
 def _request_fandango(url):
-    headers = {"referer": "https://www.fandango.com"}
-    response = _request(url, headers=headers)
+    response = _request(url, headers=FANDANGO_HEADERS)
     try:
         return response.json()
-    except requests.JSONDecodeError as exc:
+    except ValueError as exc:
         raise ValueError(f"Request to {url} did not return JSON. Got: {response.text}")
 
+def _showtimes_url(theater_code, showdate):
+    return f"https://www.fandango.com/napi/theaterMovieShowtimes/{theater_code}?startDate={showdate.isoformat()}"
+
 def _retrieve_showtimes(theater_code, showdate):
-    url = f"https://www.fandango.com/napi/theaterMovieShowtimes/{theater_code}?startDate={showdate.isoformat()}"
-    return _request_fandango(url)
+    return _request_fandango(_showtimes_url(theater_code, showdate))
 
-def _search_theaters(name):
+async def _retrieve_showtimes_async(fetcher, theater_code, showdate):
+    return await fetcher.get_json(_showtimes_url(theater_code, showdate), headers=FANDANGO_HEADERS)
+
+def _search_url(name):
     search_param = urlencode({"search": name})
-    search_url = f"https://www.fandango.com/napi/home/autocompleteDesktopSearch?{search_param}"
-    search_response = _request_fandango(search_url)
+    return f"https://www.fandango.com/napi/home/autocompleteDesktopSearch?{search_param}"
+
+def _search_theaters(name):
+    search_response = _request_fandango(_search_url(name))
     return search_response["resultsByType"]["theaters"]["items"]
 
-def _get_timezone(latitude, longitude):
-    tzdb_url = f"http://api.timezonedb.com/v2.1/get-time-zone?key={os.environ['TZDB_KEY']}&format=json&by=position&lat={latitude}&lng={longitude}"
-    tzdb_response = _request(tzdb_url)
-    if tzdb_response.status_code == 429:
-        time.sleep(1)
-        return _get_timezone(latitude, longitude)
+async def _search_theaters_async(fetcher, name):
+    search_response = await fetcher.get_json(_search_url(name), headers=FANDANGO_HEADERS)
+    return search_response["resultsByType"]["theaters"]["items"]
 
-    return tzdb_response.json()["zoneName"]
+def _parse_geo(geo):
+    if not geo or geo.get("latitude") is None or geo.get("longitude") is None:
+        return None
+    return float(geo["latitude"]), float(geo["longitude"])
 
-def _showtimes_iter(theater_code, date_range):
+def _geo_from_showtimes(showtimes_json):
+    return _parse_geo(showtimes_json["viewModel"]["theater"]["details"]["geo"])
+
+def _showdates_iter(date_range):
     current_date, end_date = date_range
     while current_date <= end_date:
-        yield _retrieve_showtimes(theater_code, current_date)
+        yield current_date
 
         current_date += timedelta(days=1)
 
+def _showtimes_iter(theater_code, date_range):
+    for showdate in _showdates_iter(date_range):
+        yield _retrieve_showtimes(theater_code, showdate)
 
-def load_schedules_by_day(theater_info, date_range, quiet=False):
-    schedules_by_day = []
+
+def iter_schedules_by_day(theater_info, date_range, quiet=False):
     if not quiet:
         print(".", end="", flush=True)
     for showtimes_json in _showtimes_iter(theater_info["code"], date_range):
         if "viewModel" in showtimes_json:
-            schedules_by_day.append(_load_schedule(showtimes_json, theater_info))
+            yield _load_schedule(showtimes_json, theater_info)
 
         if not quiet:
             print(".", end="", flush=True)
 
+def load_schedules_by_day(theater_info, date_range, quiet=False):
+    return list(iter_schedules_by_day(theater_info, date_range, quiet))
+
+async def load_schedules_by_day_async(theater_info, date_range, quiet=False, *, fetcher):
+    showdates = list(_showdates_iter(date_range))
+    all_showtimes_json = await asyncio.gather(*[_retrieve_showtimes_async(fetcher, theater_info["code"], showdate) for showdate in showdates])
+
+    schedules_by_day = []
+    for showtimes_json in all_showtimes_json:
+        if "viewModel" in showtimes_json:
+            schedules_by_day.append(_load_schedule(showtimes_json, theater_info))
+
+    if not quiet:
+        print("." * (len(showdates) + 1), end="", flush=True)
+
     return schedules_by_day
 
-def search(query):
-    search_results = _search_theaters(query)
-    if not search_results:
-        return []
-        
+def _search_results(query, search_results):
     results = []
+    geo_by_code = {}
     for result in search_results:
         link = result["link"]
         theater_code = link.strip("/").split("/", 1)[0].rsplit("-", 1)[1]
+        geo = _parse_geo(result.get("geo"))
+        if geo:
+            geo_by_code[theater_code] = geo
 
         results.append({
             "query": query,
@@ -171,51 +220,145 @@ def search(query):
             "is_open": True,
             "parser": "fandango_json"
         })
+
+    db.store_theater_geos(geo_by_code, datetime.now(timezone.utc))
     return results
 
+def search(query):
+    return _search_results(query, _search_theaters(query))
+
+async def search_async(query, *, fetcher):
+    return _search_results(query, await _search_theaters_async(fetcher, query))
+
+# The theater's location is only in its showtimes payload (and sometimes its
+# search result), so it's cached once read. The time zone itself is resolved
+# locally from the location.
+def _store_fetched_geo(theater_code, geo):
+    if geo is None:
+        raise ValueError(f"Fandango didn't give a location for theater {theater_code}, so its time zone is unknown.")
+    db.store_theater_geos({theater_code: geo}, datetime.now(timezone.utc))
+    return geo
+
 def get_tzname(theater_code):
-    showtime_response = _retrieve_showtimes(theater_code, date.today() + timedelta(days=1))
-    theater_info = showtime_response["viewModel"]["theater"]["details"]
-    return _get_timezone(**theater_info["geo"])
+    geo = db.load_theater_geos([theater_code]).get(theater_code)
+    if not geo:
+        geo = _store_fetched_geo(theater_code, _geo_from_showtimes(_retrieve_showtimes(theater_code, date.today() + timedelta(days=1))))
+    return tzname_at(*geo)
+
+async def get_tzname_async(theater_code, *, fetcher):
+    geo = db.load_theater_geos([theater_code]).get(theater_code)
+    if not geo:
+        showtimes_json = await _retrieve_showtimes_async(fetcher, theater_code, date.today() + timedelta(days=1))
+        geo = _store_fetched_geo(theater_code, _geo_from_showtimes(showtimes_json))
+    return tzname_at(*geo)
+
+
+# A seat map request can't wait past the deadline, so a hung one doesn't hold
+# the whole run open.
+def _seat_request_timeout(deadline):
+    remaining = (deadline - datetime.now(timezone.utc)).total_seconds()
+    return max(min(remaining, fetch.REQUEST_TIMEOUT), MIN_SEAT_REQUEST_TIMEOUT)
 
 
-def _retrieve_seats(showtime_hash_code):
+def _retrieve_seats(showtime_hash_code, deadline):
     if not showtime_hash_code:
         return {}
 
     url = f"https://www.fandango.com/napi/seatMap/{showtime_hash_code}"
-    return _request_fandango(url)
+    response = _request(url, headers=FANDANGO_HEADERS, timeout=_seat_request_timeout(deadline))
+    if response.status_code == 429:
+        raise RateLimitedError(response.headers.get("Retry-After"))
+
+    try:
+        return response.json()
+    except ValueError as exc:
+        raise ValueError(f"Request to {url} did not return JSON. Got: {response.text}")
 
 
-def gather_seat_info(showtimes):
+def needs_screen_lookup(showtime):
+    extra_properties = showtime["extra_properties"]
+    return bool(extra_properties.get("hash")) and not showtime.get("screen") and extra_properties.get("type") not in UNSELLABLE_SHOWTIME_TYPES
+
+
+def _auditorium_from_seat_info(showtime, seat_info):
+    if not seat_info:
+        return None
+    elif isinstance(seat_info, list):
+        if any(payload.get("id") in SEAT_INFO_ERROR_CODES for payload in seat_info):
+            return None
+        print(f"UNKNOWN: {showtime['title']} @ {showtime['start_time']}: {seat_info}")
+    elif seat_info.get("error"):
+        # This may occur when "type" == "soldout".
+        return None
+
+    try:
+        return seat_info["auditoriumId"]
+    except TypeError as exc:
+        raise ValueError(f"SEAT INFO: {seat_info}")
+    except Exception as exc:
+        print(seat_info)
+        raise exc
+
+
+# Requests the seat maps in rounds, sizing each round by how the last one
+# went: the concurrency grows by one after a clean round, and halves after a
+# round with too many errors or any rate limiting. Rate limited requests are
+# retried in a later round, after backing off.
+def _rate_limit_wait(retry_after, rate_limited_rounds):
+    seconds = float(retry_after) if retry_after and retry_after.isdigit() else rate_limited_rounds
+    return min(timedelta(seconds=seconds), MAX_RATE_LIMIT_WAIT)
+
+
+def gather_seat_info(showtimes, deadline=None):
+    deadline = deadline or datetime.now(timezone.utc) + get_scan_budget()
+    showtime_by_hash = {showtime["extra_properties"]["hash"]: showtime for showtime in showtimes if showtime["extra_properties"].get("hash")}
+    pending_hashes = list(showtime_by_hash)
+
     hash_to_auditorium = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_hash = {executor.submit(_retrieve_seats, showtime["extra_properties"].get("hash")): showtime for showtime in showtimes}
-        for future in concurrent.futures.as_completed(future_to_hash):
-            showtime = future_to_hash[future]
-            try:
-                seat_info = future.result()
-            except Exception as exc:
-                # TODO: Switch this to ID if that field proves stable.
-                print(f'{showtime["extra_properties"].get("hash")} generated an exception: {exc}')
-                continue
-
-            if not seat_info:
-                continue
-            elif isinstance(seat_info, list):
-                if any(payload.get("id") in SEAT_INFO_ERROR_CODES for payload in seat_info):
+    workers = INITIAL_SEAT_WORKERS
+    rate_limited_rounds = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_SEAT_WORKERS) as executor:
+        while pending_hashes and datetime.now(timezone.utc) < deadline:
+            batch, pending_hashes = pending_hashes[:workers], pending_hashes[workers:]
+            future_to_hash = {executor.submit(_retrieve_seats, hash_, deadline): hash_ for hash_ in batch}
+
+            error_count = 0
+            retry_after = None
+            rate_limited_hashes = []
+            for future in concurrent.futures.as_completed(future_to_hash):
+                hash_ = future_to_hash[future]
+                try:
+                    seat_info = future.result()
+                except RateLimitedError as exc:
+                    rate_limited_hashes.append(hash_)
+                    retry_after = exc.retry_after
+                    continue
+                except Exception as exc:
+                    # TODO: Switch this to ID if that field proves stable.
+                    print(f'{hash_} generated an exception: {exc}')
+                    error_count += 1
                     continue
-                print(f"UNKNOWN: {showtime['title']} @ {showtime['start_time']}: {seat_info}")
-            elif seat_info.get("error"):
-                # This may occur when "type" == "soldout".
-                continue
-            
-            try:
-                hash_to_auditorium[showtime["extra_properties"]["hash"]] = seat_info["auditoriumId"]
-            except TypeError as exc:
-                raise ValueError(f"SEAT INFO: {seat_info}")
-            except Exception as exc:
-                print(seat_info)
-                raise exc
-            
+
+                auditorium = _auditorium_from_seat_info(showtime_by_hash[hash_], seat_info)
+                if auditorium:
+                    hash_to_auditorium[hash_] = auditorium
+
+            if rate_limited_hashes:
+                rate_limited_rounds += 1
+                pending_hashes = rate_limited_hashes + pending_hashes
+                workers = max(MIN_SEAT_WORKERS, workers // 2)
+
+                wait = _rate_limit_wait(retry_after, rate_limited_rounds)
+                if rate_limited_rounds > MAX_RATE_LIMITED_ROUNDS or datetime.now(timezone.utc) + wait >= deadline:
+                    break
+                time.sleep(wait.total_seconds())
+            elif error_count / len(batch) > MAX_SEAT_ERROR_RATE:
+                workers = max(MIN_SEAT_WORKERS, workers // 2)
+            else:
+                rate_limited_rounds = 0
+                workers = min(MAX_SEAT_WORKERS, workers + 1)
+
+    if pending_hashes:
+        print(f"Fandango seat maps: leaving {len(pending_hashes)} for the next run")
+
     return hash_to_auditorium
@@ -0,0 +1,76 @@
+import os
+from contextlib import contextmanager
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.filter import ElementFilter
+
+try:
+    import lxml
+    DEFAULT_BACKEND = "lxml"
+except ImportError:
+    DEFAULT_BACKEND = "html.parser"
+
+BASELINE_BACKEND = "html.parser"
+
+_use_baseline = False
+
+
+def by_class(*classes):
+    return SoupStrainer(attrs={"class": list(classes)})
+
+def by_id(id_):
+    return SoupStrainer(attrs={"id": id_})
+
+def by_tag(name, **attrs):
+    return SoupStrainer(name, attrs=attrs)
+
+
+# Keeps what any of the given strainers would, so that a page with several
+# parts of interest is still parsed only once.
+class _AnyOf(ElementFilter):
+    def __init__(self, strainers):
+        super().__init__()
+        self.strainers = strainers
+
+    @property
+    def includes_everything(self):
+        return any(strainer.includes_everything for strainer in self.strainers)
+
+    @property
+    def excludes_everything(self):
+        return all(strainer.excludes_everything for strainer in self.strainers)
+
+    def match(self, element, _known_rules=False):
+        return any(strainer.match(element) for strainer in self.strainers)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return any(strainer.allow_tag_creation(nsprefix, name, attrs) for strainer in self.strainers)
+
+    def allow_string_creation(self, string):
+        return any(strainer.allow_string_creation(string) for strainer in self.strainers)
+
+def any_of(*strainers):
+    return _AnyOf(strainers)
+
+
+# Builds a tree using the fastest backend available. When given a strainer,
+# only the elements it matches (and their descendants) end up in the tree,
+# which skips building the large parts of each page the parsers never read.
+def parse_html(text, only=None):
+    if _use_baseline:
+        return BeautifulSoup(text, BASELINE_BACKEND)
+
+    backend = os.environ.get("MOVIE_VIEWER_HTML_BACKEND", DEFAULT_BACKEND)
+    return BeautifulSoup(text, backend, parse_only=only)
+
+
+# Parses whole pages with the pure-Python parser, as was done before the
+# backend was swappable. Used to check the faster parse's output against.
+@contextmanager
+def baseline():
+    global _use_baseline
+    _use_baseline = True
+    try:
+        yield
+    finally:
+        _use_baseline = False
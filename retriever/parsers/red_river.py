@@ -4,10 +4,11 @@ import re
 from datetime import date, datetime, timedelta
 from urllib.parse import urlsplit
 
-import requests
-from bs4 import BeautifulSoup, Tag
+from bs4 import Tag
 
-from retriever.schedule import DaySchedule, FullSchedule
+from retriever import fetch, parse_pool
+from retriever.parsers import markup
+from retriever.schedule import DaySchedule, FullSchedule, parse_clock_time, schedules_from_records, schedules_to_records
 
 THEATER_NAME = "Red River"
 MAIN_URL = "https://redrivertheatres.org/"
@@ -17,7 +18,7 @@ RUNTIME_RE = re.compile(r"\((?P<runtime>\d{1,3}) min.*\) \d{4}")
 SHOWTIME_INFO_RE = re.compile(r"(?P<showtime>\d\d?:\d\d (?:am|pm|AM|PM))(?: Screen (?P<screen>\d))?")
 
 def _retrieve_page(url):
-    return requests.get(url, headers=REQUEST_HEADERS).text
+    return fetch.get(url, headers=REQUEST_HEADERS).text
 
 def _get_programs(movie_info):
     programs = set()
@@ -81,12 +82,9 @@ def _load_schedules(page, extra_info_dict, tzname):
 
             schedule = schedules[showdate] = schedules.get(showdate, DaySchedule(THEATER_NAME, showdate))
             
-            movie = next((m for m in schedule.movies if m.name == name), None)
-            if not movie:
-                runtime_str = extra_info.get("runtime", "0")
-                movie = schedule.add_raw_movie(name, runtime_str)
+            movie = schedule.get_or_add_raw_movie(name, extra_info.get("runtime", "0"))
 
-            key = (showdate, datetime.strptime(raw_start_time, "%I:%M %p").time())
+            key = (showdate, parse_clock_time(raw_start_time))
             extra_showtime_info = extra_info["showtimes"].get(key, {})
             screen = extra_showtime_info.get("screen") or None
             id_ = extra_showtime_info.get("id") or None
@@ -103,8 +101,8 @@ def _load_schedules(page, extra_info_dict, tzname):
 # However, the main ticketing page doesn't include runtime or screen info.
 # Thus, we attempt to load them from the main page, so they can be looked up
 # while parsing the ticketing page.
-def _load_extra_info_by_movies():
-    main_html = BeautifulSoup(_retrieve_page(MAIN_URL), 'html.parser')
+def _load_extra_info_by_movies(main_text):
+    main_html = markup.parse_html(main_text, markup.by_class("podsfilm"))
     info_dict = {}
     for movie_info in main_html.find_all(class_="podsfilm"):
         name = _clean_name(movie_info.find(class_="podsfilmtitlelink").get_text(strip=True))
@@ -123,7 +121,7 @@ def _load_extra_info_by_movies():
                 curdate = datetime.strptime(showtime_el.get_text(strip=True), "%A, %b %d").replace(year=date.today().year).date()
             elif "arthousebutton" in showtime_el.get("class"):
                 info = SHOWTIME_INFO_RE.match(showtime_el.get_text(strip=True)).groupdict()
-                showtime = datetime.strptime(info["showtime"], "%I:%M %p").time()
+                showtime = parse_clock_time(info["showtime"])
                 showtime_info[(curdate, showtime)] = {
                     "screen": info["screen"]
                 }
@@ -138,9 +136,17 @@ def _load_extra_info_by_movies():
     return info_dict
 
 
+def _parse_pages(showtimes_text, main_text, tzname):
+    # The sessions and the JSON blobs holding their IDs live in separate parts
+    # of the page, so the parse keeps both.
+    showtimes_only = markup.any_of(markup.by_id("sessionsByDateConent"), markup.by_tag("script", type="application/ld+json"))
+    showtimes_html = markup.parse_html(showtimes_text, showtimes_only)
+    extra_info_dict = _load_extra_info_by_movies(main_text)
+    return schedules_to_records(_load_schedules(showtimes_html, extra_info_dict, tzname))
+
 def load_schedules_by_day(theater_info, date_range, quiet=False):
-    schedules_by_day = []
-    showtimes_html = BeautifulSoup(_retrieve_page(SHOWTIMES_URL), 'html.parser')
-    extra_info_dict = _load_extra_info_by_movies()
-    schedules_by_day = _load_schedules(showtimes_html, extra_info_dict, theater_info["tzname"])
+    showtimes_text = _retrieve_page(SHOWTIMES_URL)
+    main_text = _retrieve_page(MAIN_URL)
+    records = parse_pool.run(_parse_pages, showtimes_text, main_text, theater_info["tzname"])
+    schedules_by_day = schedules_from_records(THEATER_NAME, records)
     return [s for s in schedules_by_day if date_range[0] <= s.day <= date_range[1]]
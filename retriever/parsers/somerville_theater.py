@@ -1,78 +1,121 @@
+import itertools
 from datetime import date, datetime
 from xml.etree import ElementTree
 
-import requests
-from bs4 import BeautifulSoup
-
+from retriever import fetch
 from retriever.schedule import DaySchedule
 
 THEATER_NAME = "Somerville Theater"
 SHOWTIMES_URL = "https://www.somervilletheatre.com/wp-admin/admin-ajax.php?action=tapos_feed"
 SHOWTIMES_HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36'}
+CHUNK_SIZE = 64 * 1024
+
+# The feed is <root><Films><Film/>...</Films><Performances><Performance/>...</Performances></root>
+ITEM_DEPTH = 3
+
 
+def _retrieve_feed_chunks():
+    response = fetch.get(SHOWTIMES_URL, headers=SHOWTIMES_HEADERS, stream=True)
+    chunks = response.iter_content(CHUNK_SIZE)
+    first_chunk = next(chunks, b"")
+    if b"?xml" not in first_chunk.strip().split(b"\n", 1)[0]:
+        return None
 
-def _retrieve_page():
-    response_text = requests.get(SHOWTIMES_URL, headers=SHOWTIMES_HEADERS).text
-    return response_text if "?xml" in response_text.strip().splitlines()[0] else None
+    return itertools.chain([first_chunk], chunks)
 
 def _child(root, name, *, parse_none=True):
     tag = root.find(name)
     return tag.text if tag is not None and (not parse_none or tag != "None") else None
 
-def _load_schedules(schedule_xml, tzname):
-    films = {}
-    film_section = schedule_xml.find("Films")
-    for film in film_section.findall("Film"):
-        film_info = {
-            "title": _child(film, "FilmTitle", parse_none=False),
-            "runtime": _child(film, "RunningTime"),
-            "is_reperatory": _child(film, "Genre").lower() == "reperatory"
-        }
-        films[_child(film, "Code")] = film_info
+# Yields each film and performance as soon as its closing tag has been read.
+# Everything read so far in its section is then dropped, so memory use stays
+# flat no matter how large the feed gets.
+def _iter_feed_items(chunks):
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    path = []
+    first_chunk = None
+    try:
+        for chunk in chunks:
+            first_chunk = first_chunk or chunk
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == "start":
+                    path.append(element)
+                    continue
+
+                path.pop()
+                if len(path) == ITEM_DEPTH - 1:
+                    yield path[-1].tag, element
+                    path[-1].clear()
+        parser.close()
+    except ElementTree.ParseError as exc:
+        exc.msg += f"\nRAW TEXT (start): {(first_chunk or b'')[:2000]}"
+        raise exc
 
+def _parse_film(film):
+    return {
+        "title": _child(film, "FilmTitle", parse_none=False),
+        "runtime": _child(film, "RunningTime"),
+        "is_reperatory": _child(film, "Genre").lower() == "reperatory"
+    }
+
+def _parse_performance(perf, showdate):
+    programs = set()
+    perf_cat = _child(perf, "PerfCat")
+    if perf_cat and perf_cat != "Standard":
+        programs.add(perf_cat)
+
+    return {
+        "id": _child(perf, "Code"),
+        "film_code": _child(perf, "FilmCode"),
+        "showdate": showdate,
+        "start_dt": datetime.strptime(_child(perf, "StartTime"), "%H:%M:%S"),
+        "format": _child(perf, "PerfFlags") or "Standard",
+        "screen": _child(perf, "ScreenCode"),
+        "programs": programs
+    }
+
+def _add_performance(schedules, performance, movie_info, tzname):
+    showdate = performance["showdate"]
+    schedule = schedules[showdate] = schedules.get(showdate, DaySchedule(THEATER_NAME, showdate))
+
+    movie = schedule.get_or_add_raw_movie(movie_info["title"], movie_info["runtime"])
+
+    programs = ({"Reperatory"} if movie_info["is_reperatory"] else set()) | performance["programs"]
+    movie.add_raw_showing(performance["id"], performance["start_dt"], showdate, tzname, performance["format"], performance["screen"], programs=programs)
+
+def _load_schedules(feed_items, date_range, tzname):
+    films = {}
     schedules = {}
-    performance_section = schedule_xml.find("Performances")
-    for perf in performance_section.findall("Performance"):
-        showdate = date.fromisoformat(_child(perf, "PerformDate"))
-
-        schedule = schedules[showdate] = schedules.get(showdate, DaySchedule(THEATER_NAME, showdate))
-
-        id_ = _child(perf, "Code")
-        film_code = _child(perf, "FilmCode")
-        movie_info = films.get(film_code)
+    # Performances whose film hasn't been read yet, should the feed ever list
+    # the performances first.
+    unresolved_performances = []
+    for section, element in feed_items:
+        if section == "Films" and element.tag == "Film":
+            films[_child(element, "Code")] = _parse_film(element)
+        elif section == "Performances" and element.tag == "Performance":
+            showdate = date.fromisoformat(_child(element, "PerformDate"))
+            if not date_range[0] <= showdate <= date_range[1]:
+                continue
+
+            performance = _parse_performance(element, showdate)
+            movie_info = films.get(performance["film_code"])
+            if movie_info:
+                _add_performance(schedules, performance, movie_info, tzname)
+            else:
+                unresolved_performances.append(performance)
+
+    for performance in unresolved_performances:
+        movie_info = films.get(performance["film_code"])
         if not movie_info:
-            raise ValueError("Found performance that referenced non-existing film code: {file_code}.")
-
-        name = movie_info["title"]
-        movie = next((m for m in schedule.movies if m.name == name), None)
-        if not movie:
-            runtime = movie_info["runtime"]
-            movie = schedule.add_raw_movie(name, runtime)
-
-        start_dt = datetime.strptime(_child(perf, "StartTime"), "%H:%M:%S")
-        fmt = _child(perf, "PerfFlags") or "Standard"
-        screen = _child(perf, "ScreenCode")
-
-        programs = {"Reperatory"} if movie_info["is_reperatory"] else set()
-        perf_cat = _child(perf, "PerfCat")
-        if perf_cat and perf_cat != "Standard":
-            programs.add(perf_cat)
-
-        movie.add_raw_showing(id_, start_dt, showdate, tzname, fmt, screen, programs=programs)
+            raise ValueError(f"Found performance that referenced non-existing film code: {performance['film_code']}.")
+        _add_performance(schedules, performance, movie_info, tzname)
 
     return sorted(schedules.values(), key=lambda s: s.day)
 
 def load_schedules_by_day(theater_info, date_range, quiet=False):
-    schedules_by_day = []
-    showtimes_xml_text = _retrieve_page()
-    if not showtimes_xml_text:
+    feed_chunks = _retrieve_feed_chunks()
+    if not feed_chunks:
         return []
 
-    try:
-        showtimes_xml = ElementTree.fromstring(showtimes_xml_text)
-    except ElementTree.ParseError as exc:
-        exc.msg += f"\nRAW TEXT: {showtimes_xml_text}"
-        raise exc
-
-    schedules_by_day = _load_schedules(showtimes_xml, theater_info["tzname"])
-    return [s for s in schedules_by_day if date_range[0] <= s.day <= date_range[1]]
+    return _load_schedules(_iter_feed_items(feed_chunks), date_range, theater_info["tzname"])
@@ -0,0 +1,114 @@
+import base64
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone
+
+ICS_PRODID = "-//movie-viewer//schedules//EN"
+# Content lines longer than this many bytes must be folded (RFC 5545 3.1).
+ICS_LINE_LIMIT = 75
+# Encoded a multiple of 3 bytes at a time, so that chunks need no padding.
+BASE64_CHUNK_SIZE = 3 * 16 * 1024
+
+IcsEvent = namedtuple("IcsEvent", ["summary", "start", "end", "description", "location"], defaults=[None, None])
+
+
+class SizeLimitError(ValueError):
+    pass
+
+
+def _ics_text(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_time(dt):
+    if isinstance(dt, str):
+        dt = datetime.fromisoformat(dt)
+    return dt.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _fold(line):
+    if len(line.encode()) <= ICS_LINE_LIMIT:
+        return line + "\r\n"
+
+    # Continuation lines start with a space, which counts towards the limit.
+    pieces, piece, piece_size, limit = [], [], 0, ICS_LINE_LIMIT
+    for char in line:
+        char_size = len(char.encode())
+        if piece_size + char_size > limit:
+            pieces.append("".join(piece))
+            piece, piece_size, limit = [], 0, ICS_LINE_LIMIT - 1
+        piece.append(char)
+        piece_size += char_size
+    pieces.append("".join(piece))
+    return "\r\n ".join(pieces) + "\r\n"
+
+
+def iter_ics(events):
+    """Yields an iCalendar file line by line, reading events only as needed."""
+    stamp = _ics_time(datetime.now(timezone.utc))
+
+    yield "BEGIN:VCALENDAR\r\n"
+    yield f"PRODID:{ICS_PRODID}\r\n"
+    yield "VERSION:2.0\r\n"
+    for event in events:
+        yield "BEGIN:VEVENT\r\n"
+        yield f"DTSTAMP:{stamp}\r\n"
+        yield f"UID:{uuid.uuid1()}\r\n"
+        yield f"DTSTART:{_ics_time(event.start)}\r\n"
+        yield f"DTEND:{_ics_time(event.end)}\r\n"
+        yield _fold(f"SUMMARY:{_ics_text(event.summary)}")
+        if event.description:
+            yield _fold(f"DESCRIPTION:{_ics_text(event.description)}")
+        if event.location:
+            yield _fold(f"LOCATION:{_ics_text(event.location)}")
+        yield "END:VEVENT\r\n"
+    yield "END:VCALENDAR\r\n"
+
+
+def write_ics(events, out):
+    out.writelines(iter_ics(events))
+
+
+class Base64Writer:
+    """A write-only text stream that base64-encodes what's written to it.
+
+    Text is encoded in chunks as it comes in, so only the encoded result is
+    ever held in full. Exceeding max_size (in encoded bytes) raises
+    SizeLimitError as soon as it happens.
+    """
+    def __init__(self, max_size=None, encoding="utf-8"):
+        self.max_size = max_size
+        self.encoding = encoding
+        self._pending = []
+        self._pending_size = 0
+        self._encoded = []
+        self._encoded_size = 0
+
+    def write(self, text):
+        data = text.encode(self.encoding)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= BASE64_CHUNK_SIZE:
+            self._encode_pending(final=False)
+        return len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def _encode_pending(self, final):
+        data = b"".join(self._pending)
+        cut = len(data) if final else len(data) - len(data) % 3
+        self._pending = [data[cut:]]
+        self._pending_size = len(data) - cut
+
+        encoded = base64.b64encode(data[:cut])
+        self._encoded.append(encoded)
+        self._encoded_size += len(encoded)
+        if self.max_size is not None and self._encoded_size > self.max_size:
+            raise SizeLimitError(f"The encoded content exceeds {self.max_size} bytes.")
+
+    def getvalue(self):
+        self._encode_pending(final=True)
+        self._encoded = [b"".join(self._encoded)]
+        return self._encoded[0]
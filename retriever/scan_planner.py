@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from retriever import db
+from retriever.utils import date_ranges
+
+# Each tier is the last day (as an offset from today) it covers, and how long
+# to wait between scans of those days. Near days change often, while the far
+# end of the window rarely does.
+SCAN_TIERS = (
+    (2, timedelta(0)),
+    (9, timedelta(hours=6)),
+    (None, timedelta(days=1)),
+)
+# The days scanned on every run. A theater still working through an earlier
+# plan has these planned anew regardless, so they're never stuck behind it.
+NEAR_TIER_DAYS = SCAN_TIERS[0][0]
+
+# Cron invocations don't fire at exactly the same second each time, so a day
+# last scanned 5:59:30 ago should still count as due for a 6 hour tier.
+SCAN_INTERVAL_SLACK = timedelta(minutes=15)
+
+
+def scan_interval(day_offset):
+    for last_offset, interval in SCAN_TIERS:
+        if last_offset is None or day_offset <= last_offset:
+            return interval
+    return SCAN_TIERS[-1][1]
+
+
+def due_days(theater, today, now, days_to_scan, skip_days=frozenset()):
+    last_day = today + timedelta(days=days_to_scan)
+    scan_times = db.load_day_scan_times(theater, today, last_day)
+
+    days = []
+    for day_offset in range(days_to_scan + 1):
+        day = today + timedelta(days=day_offset)
+        if day in skip_days:
+            continue
+
+        last_scan_time = scan_times.get(day)
+        if not last_scan_time or now - last_scan_time >= scan_interval(day_offset) - SCAN_INTERVAL_SLACK:
+            days.append(day)
+    return days
+
+
+def due_date_ranges(theater, today, now, days_to_scan, skip_days=frozenset()):
+    days = due_days(theater, today, now, days_to_scan, skip_days)
+    if not days:
+        return []
+
+    return [(start, end or start) for start, end in date_ranges(days)]
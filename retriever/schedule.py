@@ -1,6 +1,11 @@
 import calendar
+import io
 import re
-from datetime import date, datetime, timedelta
+import sys
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfoNotFoundError
 
 from retriever.utils import offset_timezone
 from tzlocal import get_localzone_name
@@ -8,6 +13,8 @@ from tzlocal import get_localzone_name
 # Handles anything from "2hr 41min" to "2 hrs 41 mins" and "41 min"
 RUNTIME_RE = re.compile(r"(?:(?P<hr>\d) ?hrs?)? ?(?:(?P<min>\d\d?\d?) ?mins?)?")
 LANGUAGE_RE = re.compile("([a-z]+) spoken with ([a-z]+) subtitles")
+# Handles "7:30pm", "7:30 PM", "7:30p" and "7pm"
+SHOWTIME_RE = re.compile(r"\s*(?P<hr>\d\d?)(?::(?P<min>\d\d))?\s*(?P<meridiem>[ap])m?\s*", re.IGNORECASE)
 
 WEEKDAYS = [day.lower() for day in calendar.day_name]
 WEEKDAY_ABBRS = [abbr.lower() for abbr in calendar.day_abbr]
@@ -17,11 +24,44 @@ PIVOT_DAY = WEEKDAYS.index("thursday")
 
 SYSTEM_TZNAME = get_localzone_name()
 
+# A flat, picklable form of a single showing. Parsers running in a worker
+# process hand their results back as these rather than as object trees.
+ShowingRecord = namedtuple("ShowingRecord", ["day", "title", "runtime_min", "id", "fmt", "language", "programs", "start", "end", "screen", "extra_properties"])
+
 
 class ParseError(ValueError):
     pass
 
 
+# A full scan holds tens of thousands of showings, which mostly share a few
+# formats, languages, screens and program sets. Each distinct value is kept
+# once, and every showing points at it.
+_shared_programs = {}
+
+def _intern(value):
+    return sys.intern(value) if value is not None else None
+
+def _share_programs(programs):
+    programs = frozenset(programs)
+    return _shared_programs.setdefault(programs, programs)
+
+
+@lru_cache(maxsize=1024)
+def parse_clock_time(raw_showtime):
+    """Parses a 12-hour showtime, as the theaters list them, into a naive time.
+
+    There are only a few hundred distinct showtime strings across every
+    theater, so each is only parsed once.
+    """
+    re_match = SHOWTIME_RE.fullmatch(raw_showtime)
+    hour = int(re_match.group("hr")) if re_match else 0
+    minute = int(re_match.group("min") or 0) if re_match else 0
+    if not re_match or not 1 <= hour <= 12 or minute > 59:
+        raise ValueError(f"Expected a showtime like 7:30pm. Got: {raw_showtime}")
+
+    is_pm = re_match.group("meridiem").lower() == "p"
+    return time(hour % 12 + (12 if is_pm else 0), minute)
+
 def time_str_parser(value, *, tzname=None):
     tz = offset_timezone(tzname or SYSTEM_TZNAME)
     if value[-1] in ("p", "a"):
@@ -92,52 +132,129 @@ def date_range_str_parser(value, *, tzname=None):
 
     return (start, end)
 
+# A bound without a time zone is a wall-clock time at the theater. One with a
+# named zone (as from time_str_parser) carries that zone's offset on the day
+# it was parsed, so it's put on the showing's date with the zone's offset for
+# that day instead. Otherwise a showing past a DST change would be compared
+# an hour off.
+def _bound_timezone(tz, day):
+    if isinstance(tz, timezone):
+        try:
+            return offset_timezone(tz.tzname(None), day)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return tz
+
+def _comparable_start(start, bound):
+    if not bound.tzinfo:
+        return start.replace(tzinfo=None), datetime.combine(start.date(), bound)
+    return start, datetime.combine(start.date(), bound.replace(tzinfo=None), _bound_timezone(bound.tzinfo, start.date()))
+
+def _lower_set(values):
+    return frozenset(value.lower() for value in (values or []))
+
+def _value_check(include, exclude):
+    if include and exclude:
+        return lambda value: value is not None and value.lower() in include and value.lower() not in exclude
+    elif include:
+        return lambda value: value is not None and value.lower() in include
+    elif exclude:
+        return lambda value: value is None or value.lower() not in exclude
+    return None
+
+def _programs_check(include, exclude):
+    if include and exclude:
+        return lambda programs: any(p.lower() in include for p in programs) and not any(p.lower() in exclude for p in programs)
+    elif include:
+        return lambda programs: any(p.lower() in include for p in programs)
+    elif exclude:
+        return lambda programs: not any(p.lower() in exclude for p in programs)
+    return None
+
+
 class Filter:
     @staticmethod
     def empty():
         return Filter(None, None, None, None, None, None)
 
-    def __init__(self, earliest_start, latest_start, movies, exclude_movies, fmts, exclude_fmts):
+    def __init__(self, earliest_start, latest_start, movies, exclude_movies, fmts, exclude_fmts, *,
+            languages=None, exclude_languages=None, programs=None, exclude_programs=None, screens=None, exclude_screens=None):
         self.earliest_start = earliest_start
         self.latest_start = latest_start
-        self.movies = [m.lower() for m in (movies or [])]
-        self.exclude_movies = [m.lower() for m in (exclude_movies or [])]
-        self.fmts = fmts
-        self.exclude_fmts = exclude_fmts
+        self.movies = _lower_set(movies)
+        self.exclude_movies = _lower_set(exclude_movies)
+        self.fmts = _lower_set(fmts)
+        self.exclude_fmts = _lower_set(exclude_fmts)
+        self.languages = _lower_set(languages)
+        self.exclude_languages = _lower_set(exclude_languages)
+        self.programs = _lower_set(programs)
+        self.exclude_programs = _lower_set(exclude_programs)
+        self.screens = _lower_set(screens)
+        self.exclude_screens = _lower_set(exclude_screens)
+
+        self._title_check = _value_check(self.movies, self.exclude_movies)
+        self._showing_check = self._compile_showing_check()
+
+    # Builds a single predicate out of only the criteria that were given, so
+    # a showing is never checked against a criterion that can't exclude it.
+    def _compile_showing_check(self):
+        checks = []
+        for index, check in ((0, _value_check(self.fmts, self.exclude_fmts)),
+                             (1, _value_check(self.languages, self.exclude_languages)),
+                             (2, _programs_check(self.programs, self.exclude_programs)),
+                             (3, _value_check(self.screens, self.exclude_screens))):
+            if check:
+                checks.append((index, check))
+        if self.earliest_start or self.latest_start:
+            checks.append((4, self.apply_start_filter))
+
+        if not checks:
+            return None
+        return lambda fields: all(check(fields[index]) for index, check in checks)
+
+    @property
+    def is_empty(self):
+        return not self._title_check and not self._showing_check
 
     def apply_movie_filter(self, name):
-        if self.movies:
-            return name.lower() in self.movies
-        elif self.exclude_movies:
-            return name.lower() not in self.exclude_movies
-        return True
+        return not self._title_check or self._title_check(name)
 
     def apply_start_filter(self, start):
-        if self.earliest_start and start < self.earliest_start:
-            return False
-        if self.latest_start and start > self.latest_start:
-            return False
+        if self.earliest_start:
+            start_value, bound_value = _comparable_start(start, self.earliest_start)
+            if start_value < bound_value:
+                return False
+        if self.latest_start:
+            start_value, bound_value = _comparable_start(start, self.latest_start)
+            if start_value > bound_value:
+                return False
         return True
 
+    def apply_showing_filter(self, fmt, language, programs, screen, start):
+        return not self._showing_check or self._showing_check((fmt, language, programs, screen, start))
+
+    def filter_showtimes(self, showtimes):
+        """Filters showtimes as loaded from the DB, by the same rules as schedules."""
+        if self.is_empty:
+            return showtimes
+
+        return [showtime for showtime in showtimes
+                if self.apply_movie_filter(showtime["title"])
+                and self.apply_showing_filter(showtime["format"], showtime["language"], showtime["programs"], showtime["screen"], showtime["start_time"])]
+
 
 class Showing:
+    __slots__ = ("id", "fmt", "language", "programs", "start", "end", "screen", "extra_properties")
+
     @staticmethod
-    def _parse_showtime(raw_showtime, tzname):
-        tz = offset_timezone(tzname)
-        if isinstance(raw_showtime, datetime):
-            showtime = raw_showtime
-        else:
-            raw_showtime = raw_showtime.replace('p', 'pm').replace('a', 'am').replace('mm', 'm')
-            raw_showtime = raw_showtime.replace(" ", "")
-            try:
-                showtime = datetime.strptime(raw_showtime, "%I:%M%p")
-            except Exception:
-                showtime = datetime.strptime(raw_showtime, "%I%p")
-        return showtime.replace(tzinfo=tz).timetz()
+    def _parse_showtime(raw_showtime, tzname, day=None):
+        tz = offset_timezone(tzname, day)
+        showtime = raw_showtime.time() if isinstance(raw_showtime, datetime) else parse_clock_time(raw_showtime)
+        return showtime.replace(tzinfo=tz)
 
     @staticmethod
     def create(id_, raw_start_time, runtime_min, day, tzname, fmt, screen, language=None, programs=set(), **extra_properties):
-        start_time = Showing._parse_showtime(raw_start_time, tzname)
+        start_time = Showing._parse_showtime(raw_start_time, tzname, day)
         start = datetime.combine(day, start_time)
         end = start + timedelta(minutes=runtime_min)
         lang = language or "UNKNOWN"
@@ -145,16 +262,17 @@ class Showing:
 
     def __init__(self, id_, fmt, language, programs, start, end, screen=None, **extra_properties):
         self.id = str(id_) if id_ else None
-        self.fmt = fmt
-        self.language = language
-        self.programs = set(programs)
+        self.fmt = _intern(fmt)
+        self.language = _intern(language)
+        # Shared between showings, so it must never be modified in place.
+        self.programs = _share_programs(programs)
         self.start = start
         self.end = end
-        self.screen = str(screen) if screen else None
+        self.screen = _intern(str(screen)) if screen else None
         self.extra_properties = extra_properties
 
     def filter(self, filter_params):
-        return filter_params.apply_start_filter(self.start.timetz())
+        return filter_params.apply_showing_filter(self.fmt, self.language, self.programs, self.screen, self.start)
 
     def output(self, show_date):
         date_str = f"{self.start.strftime('%a %B %d')} " if show_date else ""
@@ -171,6 +289,8 @@ class Showing:
 
 
 class Movie:
+    __slots__ = ("name", "runtime_min", "showings")
+
     @staticmethod
     def _parse_runtime(runtime_str):
         re_match = RUNTIME_RE.match(runtime_str)
@@ -203,68 +323,143 @@ class Movie:
         return bool(self.showings)
 
     def filter(self, filter_params):
-        new_movie = Movie(self.name, self.runtime_min)
+        if filter_params.is_empty:
+            return self
 
+        new_movie = Movie(self.name, self.runtime_min)
         if not filter_params.apply_movie_filter(self.name):
             return new_movie
 
-        for showing in self.showings:
-            if showing.filter(filter_params):
-                new_movie.showings.append(showing)
+        new_movie.showings = [showing for showing in self.showings if showing.filter(filter_params)]
         return new_movie
 
-    def output(self, name_only, date_only, schedule_start, schedule_end):
+    def write(self, out, name_only, date_only, schedule_start, schedule_end):
         multi_day = schedule_start != schedule_end
 
-        output = self.name
-        if not name_only:
-            if date_only:
-                first, last = min(self.showings, key=lambda s: s.start), max(self.showings, key=lambda s: s.start)
-                if multi_day and (first.start.date() != schedule_start or last.start.date() != schedule_end):
-                    first_date_str = first.start.strftime('%a, %B %d')
-                    last_date_str = last.start.strftime('%a, %B %d')
-                    output += f" ({first_date_str}" + (")" if first_date_str == last_date_str else f" to {last_date_str})")
-            else:
-                output += '\n' + '\n'.join(showing.output(multi_day) for showing in sorted(self.showings, key=lambda s: s.start))
-        return output
+        out.write(self.name)
+        if name_only:
+            return
+
+        showings = sorted(self.showings, key=lambda s: s.start)
+        if date_only:
+            first, last = showings[0].start, showings[-1].start
+            if multi_day and (first.date() != schedule_start or last.date() != schedule_end):
+                first_date_str = first.strftime('%a, %B %d')
+                last_date_str = last.strftime('%a, %B %d')
+                out.write(f" ({first_date_str}" + (")" if first_date_str == last_date_str else f" to {last_date_str})"))
+        else:
+            for showing in showings:
+                out.write('\n')
+                out.write(showing.output(multi_day))
+
+    def output(self, name_only, date_only, schedule_start, schedule_end):
+        out = io.StringIO()
+        self.write(out, name_only, date_only, schedule_start, schedule_end)
+        return out.getvalue()
 
     def __len__(self):
         return len(self.showings)
 
 
 class DaySchedule:
+    __slots__ = ("theater", "day", "movies", "_movies_by_name")
+
+    @staticmethod
+    def from_records(theater, day, records):
+        schedule = DaySchedule(theater, day)
+        for record in records:
+            movie = schedule.get_movie(record.title)
+            if movie is None:
+                movie = schedule.add_movie(Movie(record.title, record.runtime_min))
+            showing = Showing(record.id, record.fmt, record.language, record.programs, record.start, record.end, record.screen, **record.extra_properties)
+            movie.showings.append(showing)
+        return schedule
+
     def __init__(self, theater, day):
         self.theater = theater
         self.day = day
         self.movies = []
+        self._movies_by_name = {}
+
+    def add_movie(self, movie):
+        self.movies.append(movie)
+        self._movies_by_name.setdefault(movie.name, movie)
+        return movie
 
     def add_raw_movie(self, name, runtime):
-        new_movie = Movie.create(name, str(runtime))
-        self.movies.append(new_movie)
-        return new_movie
+        return self.add_movie(Movie.create(name, str(runtime)))
+
+    def get_movie(self, name):
+        return self._movies_by_name.get(name)
+
+    # A movie with no showings yet is falsy, so this checks for None rather
+    # than relying on "or".
+    def get_or_add_raw_movie(self, name, runtime):
+        movie = self.get_movie(name)
+        if movie is None:
+            movie = self.add_raw_movie(name, runtime)
+        return movie
 
     def filter(self, filter_params):
+        # An empty filter passes the schedule through untouched, unless it
+        # has movies without showings, which are still dropped.
+        if filter_params.is_empty and all(self.movies):
+            return self
+
         new_schedule = DaySchedule(self.theater, self.day)
         for movie in self.movies:
             filtered_movie = movie.filter(filter_params)
             if filtered_movie:
-                new_schedule.movies.append(filtered_movie)
+                new_schedule.add_movie(filtered_movie)
         return new_schedule
 
+    def write(self, out, name_only, date_only):
+        _write_header(out, self.day.strftime('%a, %B %d, %Y'))
+        _write_movies(out, self.movies, name_only, False, self.day, self.day)
+
     def output(self, name_only, date_only):
-        date_str = self.day.strftime('%a, %B %d, %Y')
-        seplen = len(date_str) + 2
-        output = f"""{'-' * seplen}
- {date_str}
-{'-' * seplen}
-"""
-        output += '\n'.join(movie.output(name_only, False, self.day, self.day) for movie in sorted(self.movies, key=lambda m: m.name))
-        return output
+        out = io.StringIO()
+        self.write(out, name_only, date_only)
+        return out.getvalue()
+
+    def to_records(self):
+        records = []
+        for movie in self.movies:
+            for showing in movie.showings:
+                records.append(ShowingRecord(self.day, movie.name, movie.runtime_min, showing.id, showing.fmt, showing.language,
+                        showing.programs, showing.start, showing.end, showing.screen, showing.extra_properties))
+        return records
 
     def __len__(self):
         return sum(len(m) for m in self.movies)
 
 
+def _write_header(out, date_str):
+    seplen = len(date_str) + 2
+    out.write(f"""{'-' * seplen}
+ {date_str}
+{'-' * seplen}
+""")
+
+
+def _write_movies(out, movies, name_only, date_only, schedule_start, schedule_end):
+    for idx, movie in enumerate(sorted(movies, key=lambda m: m.name)):
+        if idx:
+            out.write('\n')
+        movie.write(out, name_only, date_only, schedule_start, schedule_end)
+
+
+def schedules_to_records(schedules):
+    return [record for schedule in schedules for record in schedule.to_records()]
+
+
+def schedules_from_records(theater, records):
+    records_by_day = {}
+    for record in records:
+        records_by_day.setdefault(record.day, []).append(record)
+    return [DaySchedule.from_records(theater, day, day_records) for day, day_records in records_by_day.items()]
+
+
 class FullSchedule:
     @staticmethod
     def create(schedules):
@@ -274,15 +469,18 @@ class FullSchedule:
 
         theater = list(theaters)[0]
 
-        movies = {movie.name: movie for movie in schedules[0].movies}
-        days = [schedules[0].day]
-        for schedule in schedules[1:]:
+        # The day schedules may be shared (e.g. passed through an empty
+        # filter from a cached feed), so their movies are merged into new ones
+        # rather than into each other.
+        movies = {}
+        days = []
+        for schedule in schedules:
             days.append(schedule.day)
             for movie in schedule.movies:
-                if movie.name in movies:
-                    movies[movie.name].showings.extend(movie.showings)
-                else:
-                    movies[movie.name] = movie
+                merged_movie = movies.get(movie.name)
+                if merged_movie is None:
+                    merged_movie = movies[movie.name] = Movie(movie.name, movie.runtime_min)
+                merged_movie.showings.extend(movie.showings)
 
         days = sorted(days)
         return FullSchedule(theater, days[0], days[-1], movies.values())
@@ -293,24 +491,16 @@ class FullSchedule:
         self.end = end
         self.movies = movies
 
-    def output(self, name_only, date_only):
-        single_day = self.start != self.end
-
+    def write(self, out, name_only, date_only):
         start_date_str = self.start.strftime('%a, %B %d, %Y')
         end_date_str = self.end.strftime('%a, %B %d, %Y')
-        date_str = start_date_str + (f" - {end_date_str}" if single_day else "")
-        seplen = len(date_str) + 2
-        output = f"""{'-' * seplen}
- {date_str}
-{'-' * seplen}
-"""
-        # output += '\n'.join(movie.output(name_only, show_date=show_date) for movie in sorted(self.movies, key=lambda m: m.name))
-        movie_lines = []
-        for movie in sorted(self.movies, key=lambda m: m.name):
-            movie_date_only = date_only and (self.start != movie.first.date() or self.end != movie.last.date())
-            movie_lines.append(movie.output(name_only, date_only, self.start, self.end))
-        output += '\n'.join(movie_lines)
-        return output
+        _write_header(out, start_date_str + (f" - {end_date_str}" if self.start != self.end else ""))
+        _write_movies(out, self.movies, name_only, date_only, self.start, self.end)
+
+    def output(self, name_only, date_only):
+        out = io.StringIO()
+        self.write(out, name_only, date_only)
+        return out.getvalue()
 
     def __len__(self):
         return sum(len(m) for m in self.movies)
@@ -1,34 +1,105 @@
 import calendar
 import json
 import os
+import re
+import unicodedata
 from collections import defaultdict
 from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
 from zoneinfo import ZoneInfo
 
+from timezonefinder import TimezoneFinder
+
+_timezone_finder = None
+
+# Theaters add these to titles in their own ways, e.g. "Alien (1979)" or
+# "Wicked - Open Captions". Removed from the end of a title, repeatedly.
+TITLE_YEAR_RE = re.compile(r"\s*\((?:18|19|20)\d\d\)$")
+TITLE_EVENT_SUFFIX_RE = re.compile(r"\s*(?:[-:\u2013\u2014]\s*|\(|\[)(?:open capt(?:ions?|ioned)|closed capt(?:ions?|ioned)|"
+        r"popcorn (?:&|and) pacifiers|sensory[- ]friendly(?: screening)?|\d+(?:st|nd|rd|th) anniversary(?: edition| screening)?|"
+        r"re-?release|(?:in |on )?(?:35|70)\s?mm)[)\]]?$", re.IGNORECASE)
+
 
 class JsonEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, set):
+        if isinstance(obj, (set, frozenset)):
             return list(obj)
         if isinstance(obj, (date, time, datetime)):
             return obj.isoformat()
         return super().default(obj)
 
 
-def offset_timezone(tzname):
+@lru_cache(maxsize=None)
+def _offset_timezone_on(tzname, day):
+    # Taken at midday, as DST changes happen in the early morning and nearly
+    # every showing on the day of one starts after it.
+    midday = datetime.combine(day, time(12), ZoneInfo(tzname))
+    return timezone(midday.utcoffset(), tzname)
+
+def offset_timezone(tzname, day=None):
     """Crafts the offset version of a timezone.
 
     When applying certain timezones (e.g. America/New_York) to a time object,
     they are considered naive due to the omission of offset data (for some
-    reason). This loads up the named time zone as a datetime, extracts its
-    offset info, and crafts a fresh (named) timezone object from it.
+    reason). This extracts the named time zone's offset on the given day (or
+    today, where it is) and crafts a fresh (named) timezone object from it.
+    Each (time zone, day) is only worked out once.
+    """
+    day = day or datetime.now(ZoneInfo(tzname)).date()
+    return _offset_timezone_on(tzname, day)
+
+def tzname_at(latitude, longitude):
+    """Looks up the named time zone covering a location.
+
+    This is answered from the timezone boundaries bundled with
+    timezonefinder, so it needs no network access. The index is loaded on the
+    first lookup and kept for the rest of the process.
     """
-    now = datetime.now(ZoneInfo(tzname))
-    return timezone(now.tzinfo.utcoffset(now), tzname)
+    global _timezone_finder
+    if _timezone_finder is None:
+        _timezone_finder = TimezoneFinder()
+
+    tzname = _timezone_finder.timezone_at(lat=latitude, lng=longitude)
+    if not tzname:
+        raise ValueError(f"No time zone found at ({latitude}, {longitude}).")
+    return tzname
+
+def title_key(title):
+    """Folds a title down to a key shared by the ways theaters spell it.
+
+    Case, accents and punctuation are folded, and release years and event
+    suffixes removed, so "The Thing (1982)" and "THE THING - Open Captions"
+    both become "the thing".
+    """
+    folded = "".join(c for c in unicodedata.normalize("NFKD", title) if not unicodedata.combining(c)).casefold().strip()
+
+    stripped = None
+    while stripped != folded:
+        stripped = folded
+        folded = TITLE_EVENT_SUFFIX_RE.sub("", TITLE_YEAR_RE.sub("", folded))
+
+    words = re.findall(r"[^\W_]+", folded.replace("&", " and "))
+    return " ".join(words) or title.casefold()
+
+
+def get_http_mode():
+    return os.environ.get("MOVIE_VIEWER_HTTP_MODE", "live")
+
+def get_http_archive():
+    return os.environ.get("MOVIE_VIEWER_HTTP_ARCHIVE", "http-archive")
 
 def get_days_to_scan():
     return int(os.environ.get("MOVIE_VIEWER_SCAN_DAYS", 30))
 
+def get_scan_concurrency():
+    return int(os.environ.get("MOVIE_VIEWER_SCAN_CONCURRENCY", 8))
+
+def get_parse_workers():
+    return int(os.environ.get("MOVIE_VIEWER_PARSE_WORKERS", min(os.cpu_count() or 1, 4)))
+
+def get_scan_budget():
+    return timedelta(seconds=int(os.environ.get("MOVIE_VIEWER_SCAN_BUDGET", 240)))
+
 def group_by(items, key):
     grouped_items = defaultdict(list)
     for item in items:
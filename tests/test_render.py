@@ -0,0 +1,100 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from retriever import render
+from retriever.render import BASE64_CHUNK_SIZE, ICS_LINE_LIMIT, Base64Writer, IcsEvent, SizeLimitError
+
+EDT = timezone(timedelta(hours=-4))
+
+
+class _FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return datetime(2026, 10, 19, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def fixed_stamps(monkeypatch):
+    monkeypatch.setattr(render, "datetime", _FixedDatetime)
+    monkeypatch.setattr(render.uuid, "uuid1", lambda: "UID-1")
+
+
+def _ics(events):
+    return "".join(render.iter_ics(events))
+
+
+def test_ics_golden_output(fixed_stamps):
+    events = [
+        IcsEvent("Movie, Part 1; A\\B\nC", datetime(2026, 10, 20, 19, 30, tzinfo=EDT), datetime(2026, 10, 20, 21, 0, tzinfo=EDT)),
+        IcsEvent("A" * 80, "2026-10-21T14:00:00-04:00", "2026-10-21T15:30:00-04:00", description="Café " * 20, location="Coolidge Corner")
+    ]
+    assert _ics(events) == "\r\n".join([
+        "BEGIN:VCALENDAR",
+        "PRODID:-//movie-viewer//schedules//EN",
+        "VERSION:2.0",
+        "BEGIN:VEVENT",
+        "DTSTAMP:20261019T120000Z",
+        "UID:UID-1",
+        "DTSTART:20261020T233000Z",
+        "DTEND:20261021T010000Z",
+        "SUMMARY:Movie\\, Part 1\\; A\\\\B\\nC",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "DTSTAMP:20261019T120000Z",
+        "UID:UID-1",
+        "DTSTART:20261021T180000Z",
+        "DTEND:20261021T193000Z",
+        "SUMMARY:" + "A" * 67,
+        " " + "A" * 13,
+        "DESCRIPTION:" + "Café " * 10 + "Caf",
+        " é" + " Café" * 9 + " ",
+        "LOCATION:Coolidge Corner",
+        "END:VEVENT",
+        "END:VCALENDAR",
+        ""
+    ])
+
+
+def test_ics_lines_fold_within_the_octet_limit(fixed_stamps):
+    for summary in ("x" * 300, "é" * 200, "x" + "€" * 100, "A" * (ICS_LINE_LIMIT - len("SUMMARY:"))):
+        ics = _ics([IcsEvent(summary, "2026-10-21T14:00:00-04:00", "2026-10-21T15:30:00-04:00")])
+        lines = ics.split("\r\n")
+        assert all(len(line.encode()) <= ICS_LINE_LIMIT for line in lines)
+
+        # Unfolding (RFC 5545 3.1) gives back the whole line.
+        assert f"\r\nSUMMARY:{summary}\r\n" in ics.replace("\r\n ", "")
+
+def test_ics_line_at_the_limit_is_not_folded(fixed_stamps):
+    summary = "A" * (ICS_LINE_LIMIT - len("SUMMARY:"))
+    ics = _ics([IcsEvent(summary, "2026-10-21T14:00:00-04:00", "2026-10-21T15:30:00-04:00")])
+    assert f"\r\nSUMMARY:{summary}\r\nEND:VEVENT" in ics
+
+
+def test_base64_writer_golden_output():
+    writer = Base64Writer()
+    writer.write("Hello, ")
+    writer.write("wörld")
+    assert writer.getvalue() == b"SGVsbG8sIHfDtnJsZA=="
+
+def test_base64_writer_matches_a_single_encode_across_chunks():
+    text = "".join(f"line {idx}, é\r\n" for idx in range(BASE64_CHUNK_SIZE // 5))
+    writer = Base64Writer()
+    writer.writelines(text[idx:idx + 1000] for idx in range(0, len(text), 1000))
+    assert writer.getvalue() == base64.b64encode(text.encode())
+
+def test_base64_writer_size_cutoff():
+    writer = Base64Writer(max_size=4)
+    writer.write("abc")
+    assert writer.getvalue() == b"YWJj"
+
+    writer = Base64Writer(max_size=3)
+    writer.write("abc")
+    with pytest.raises(SizeLimitError):
+        writer.getvalue()
+
+def test_base64_writer_stops_as_soon_as_the_limit_is_passed():
+    writer = Base64Writer(max_size=10)
+    with pytest.raises(SizeLimitError):
+        writer.write("x" * BASE64_CHUNK_SIZE)
@@ -0,0 +1,53 @@
+from datetime import date, datetime, time
+
+from retriever.schedule import Filter, Showing, time_str_parser
+from retriever.utils import offset_timezone
+
+TZNAME = "America/New_York"
+# New York falls back on 2026-11-01 and springs forward on 2026-03-08.
+BEFORE_FALL_BACK = date(2026, 10, 30)
+AFTER_FALL_BACK = date(2026, 11, 2)
+BEFORE_SPRING_FORWARD = date(2026, 3, 6)
+AFTER_SPRING_FORWARD = date(2026, 3, 9)
+
+
+def _start_filter(earliest=None, latest=None):
+    return Filter(earliest, latest, None, None, None, None)
+
+def _showing(day, raw_time):
+    return Showing.create("1", raw_time, 90, day, TZNAME, "Standard", None)
+
+def _kept(filter_params, day, raw_time):
+    return _showing(day, raw_time).filter(filter_params)
+
+
+def test_parsed_bound_matches_wall_clock_on_both_sides_of_dst():
+    filter_params = _start_filter(earliest=time_str_parser("14:00", tzname=TZNAME))
+    for day in (BEFORE_FALL_BACK, AFTER_FALL_BACK, BEFORE_SPRING_FORWARD, AFTER_SPRING_FORWARD):
+        assert not _kept(filter_params, day, "1:30pm")
+        assert _kept(filter_params, day, "2:00pm")
+
+def test_bound_from_before_fall_back_applies_after_it():
+    edt = offset_timezone(TZNAME, BEFORE_FALL_BACK)
+    filter_params = _start_filter(earliest=time(14, tzinfo=edt), latest=time(20, tzinfo=edt))
+    assert not _kept(filter_params, AFTER_FALL_BACK, "1:30pm")
+    assert _kept(filter_params, AFTER_FALL_BACK, "2:00pm")
+    assert _kept(filter_params, AFTER_FALL_BACK, "8:00pm")
+    assert not _kept(filter_params, AFTER_FALL_BACK, "8:30pm")
+
+def test_bound_from_before_spring_forward_applies_after_it():
+    est = offset_timezone(TZNAME, BEFORE_SPRING_FORWARD)
+    filter_params = _start_filter(latest=time(20, tzinfo=est))
+    assert _kept(filter_params, AFTER_SPRING_FORWARD, "8:00pm")
+    assert not _kept(filter_params, AFTER_SPRING_FORWARD, "8:30pm")
+
+def test_naive_bound_is_wall_clock_time():
+    filter_params = _start_filter(earliest=time(14))
+    assert not _kept(filter_params, AFTER_FALL_BACK, "1:30pm")
+    assert _kept(filter_params, AFTER_FALL_BACK, "2:00pm")
+
+def test_db_rows_filter_like_showings_across_dst():
+    filter_params = _start_filter(earliest=time(14, tzinfo=offset_timezone(TZNAME, BEFORE_FALL_BACK)))
+    rows = [{"title": "A", "format": "Standard", "language": None, "programs": set(), "screen": None, "start_time": showing.start}
+            for showing in (_showing(AFTER_FALL_BACK, "1:30pm"), _showing(AFTER_FALL_BACK, "2:00pm"))]
+    assert [row["start_time"] for row in filter_params.filter_showtimes(rows)] == [datetime(2026, 11, 2, 14, tzinfo=offset_timezone(TZNAME, AFTER_FALL_BACK))]